@@ -24,10 +24,11 @@ class ChatGPTNode:
     FUNCTION = "execute"
     DESCRIPTION = "Generates text using ChatGPT"
     CATEGORY = "chatgpt"
+    TIMEOUT = 120
 
-    def execute(self, seed, text: str):
-        # 调用 ChatGPT 3.5-turbo 模型
-        res = openai.ChatCompletion.create(
+    async def execute(self, seed, text: str):
+        # 调用 ChatGPT 3.5-turbo 模型，异步请求使多个输入可以并发发送
+        res = await openai.ChatCompletion.acreate(
             model="gpt-3.5-turbo",
             messages=[{"role": "user", "content": text}],
         )
@@ -24,6 +24,8 @@ class EmailNode:
     FUNCTION = "execute"
     DESCRIPTION = "Send an email"
     CATEGORY = "tools/email"
+    TIMEOUT = 60
+    SIDE_EFFECTS = True
 
     def execute(self, smtp_server, smtp_port, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password):
         try:
@@ -72,6 +74,8 @@ class QQEmailNode:
     FUNCTION = "execute"
     DESCRIPTION = "Send an QQ email"
     CATEGORY = "tools/email"
+    TIMEOUT = 60
+    SIDE_EFFECTS = True
 
     def execute(self, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password):
         return EmailNode.execute(self, "smtp.qq.com", 587, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password)
@@ -96,6 +100,8 @@ class GmailEmailNode:
     FUNCTION = "execute"
     DESCRIPTION = "Send an Gmail email"
     CATEGORY = "tools/email"
+    TIMEOUT = 60
+    SIDE_EFFECTS = True
 
     def execute(self, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password):
         return EmailNode.execute(self, "smtp.gmail.com", 587, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password)
@@ -120,6 +126,8 @@ class OutlookEmailNode:
     FUNCTION = "execute"
     DESCRIPTION = "Send an Outlook email"
     CATEGORY = "tools/email"
+    TIMEOUT = 60
+    SIDE_EFFECTS = True
 
     def execute(self, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password):
         return EmailNode.execute(self, "smtp.office365.com", 587, sender_email, receiver_email, subject, message_body, smtp_username, smtp_password)
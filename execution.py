@@ -1,20 +1,70 @@
 import execution_tools
-import copy
+import execution_profile
+import execution_cache
+import internal.utils
+import concurrent.futures
+import time
+import multiprocessing
 
 
 class RunnerExecutor:
-    def __init__(self, server):
+    def __init__(self, server, parallel_workers=0, process_workers=0, output_cache=None, profile_memory=False, max_idle_instances=32, process_pool=None, instance_pool=None):
+        """
+        Args:
+            server (Server): 服务器对象。
+            parallel_workers (int, optional): 并行执行互不依赖分支的线程数，0 表示按顺序执行。默认为 0。
+            process_workers (int, optional): 执行 RUN_IN_PROCESS 节点的进程数，0 表示这些节点也在当前线程执行。默认为 0。
+            output_cache (OutputCache, optional): 跨 runner 共享的按内容寻址的输出缓存。默认为 None，不使用。
+            profile_memory (bool, optional): 是否用 tracemalloc 记录每个节点的内存峰值，会明显降低执行速度。默认为 False。
+            max_idle_instances (int, optional): 实例池中保留的空闲节点实例数上限。默认为 32。
+            process_pool (ProcessPoolExecutor, optional): 与其他执行器共享的进程池，为 None 时按 process_workers 创建。
+            instance_pool (NodeInstancePool, optional): 与其他执行器共享的节点实例池，为 None 时按 max_idle_instances 创建。
+        """
         self.outputs = {}
-        self.object_storage = {}
+        self.instance_pool = instance_pool
+        if self.instance_pool is None:
+            self.instance_pool = execution_cache.NodeInstancePool(max_idle_instances)
         self.outputs_ui = {}
-        self.old_runner = {}
+        self.old_runner = {}  # 节点 ID -> 上次执行时的节点指纹
+        self.error_snapshot = None  # 上次执行出错时出错节点及其直接上游节点的快照
+        self.profile = None  # 上次执行的 RunnerProfile
+        self.profile_memory = profile_memory
         self.server = server
+        self.client_id = None  # 当前执行的 runner 的客户端 ID
+        self.output_cache = output_cache
+        self.pool = None
+        if parallel_workers > 0:
+            self.pool = concurrent.futures.ThreadPoolExecutor(
+                max_workers=parallel_workers, thread_name_prefix="node_worker"
+            )
+        # 进程池在整个执行器生命周期内保持，子进程和其中的节点实例都会被复用
+        # 使用 spawn 避免在已有多个线程的进程中 fork
+        self.process_pool = process_pool
+        if self.process_pool is None and process_workers > 0:
+            self.process_pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=process_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=execution_tools.init_process_worker,
+            )
 
     def handle_execution_error(self, runner_id, runners, current_outputs, executed, error, ex):
         node_id = error["node_id"]
+        # 完整快照只在请求时才格式化，不随事件发送
+        self.error_snapshot = error.pop("snapshot", None)
         class_type = runners[node_id]["class_type"]
 
-        if self.server.client_id is not None:
+        # runner 被中断不是节点错误，单独通知客户端
+        if isinstance(ex, internal.utils.InterruptProcessingException):
+            if self.client_id is not None:
+                mes = {
+                    "runner_id": runner_id,
+                    "node_id": node_id,
+                    "node_type": class_type,
+                    "executed": list(executed),
+                }
+                self.server.send_sync("execution_interrupted", mes,
+                                      self.client_id)
+        elif self.client_id is not None:
             mes = {
                 "runner_id": runner_id,
                 "node_id": node_id,
@@ -27,7 +77,7 @@ class RunnerExecutor:
                 "current_outputs": error["current_outputs"],
             }
             self.server.send_sync("execution_error", mes,
-                                  self.server.client_id)
+                                  self.client_id)
 
         # Next, remove the subsequent outputs since they will not be executed
         to_delete = []
@@ -41,15 +91,17 @@ class RunnerExecutor:
             d = self.outputs.pop(o)
             del d
 
-    def execute(self, runners, runner_id, extra_data={}, execute_outputs=[]):
+    def execute(self, runners, runner_id, extra_data={}, execute_outputs=[], cancellation_token=None, trace=None):
         """
         执行节点图。
 
         Args:
             runners (dict): 节点图的节点字典。
             runner_id (str): 节点图的 ID。
-            extra_data (dict, optional): 额外的数据字典。默认为空字典。
+            extra_data (dict, optional): 额外的数据字典，可以包含 client_id 和 time_budget。默认为空字典。
             execute_outputs (list, optional): 要执行的输出节点 ID 列表。默认为空列表。
+            cancellation_token (CancellationToken, optional): runner 的取消令牌，被取消后在节点或列表元素之间停止执行。默认为 None。
+            trace (RunnerTrace, optional): 记录执行时间线的 RunnerTrace。默认为 None，不记录。
 
         Returns:
             None
@@ -58,16 +110,25 @@ class RunnerExecutor:
             None
 
         """
-        # 如果额外数据字典中包含客户端 ID，则将其设置为节点图的客户端 ID
+        self.error_snapshot = None
+        self.profile = execution_profile.RunnerProfile(self.profile_memory, trace)
+
+        # extra_data 中的 time_budget 是整个 runner 的时间预算（秒），超过后当前节点以超时错误结束
+        if extra_data.get("time_budget", None) is not None:
+            if cancellation_token is None:
+                cancellation_token = internal.utils.CancellationToken()
+            cancellation_token.set_time_budget(float(extra_data["time_budget"]))
+
+        # 如果额外数据字典中包含客户端 ID，则本次执行的事件都发送给这个客户端
         if "client_id" in extra_data:
-            self.server.client_id = extra_data["client_id"]
+            self.client_id = extra_data["client_id"]
         else:
-            self.server.client_id = None
+            self.client_id = None
 
         # 如果节点图有客户端 ID，则发送“execution_start”消息
-        if self.server.client_id is not None:
+        if self.client_id is not None:
             self.server.send_sync("execution_start", {
-                                  "runner_id": runner_id}, self.server.client_id)
+                                  "runner_id": runner_id}, self.client_id)
 
         # 删除缓存输出列表中不存在的节点
         to_delete = []
@@ -77,25 +138,20 @@ class RunnerExecutor:
         for o in to_delete:
             d = self.outputs.pop(o)
             del d
-        to_delete = []
-        for o in self.object_storage:
-            if o[0] not in runners:
-                to_delete += [o]
-            else:
-                p = runners[o[0]]
-                if o[1] != p['class_type']:
-                    to_delete += [o]
-        for o in to_delete:
-            d = self.object_storage.pop(o)
-            del d
-
-        # 删除输出节点的缓存输出列表中已经不存在的输出节点
-        for x in runners:
-            execution_tools.recursive_output_delete_if_changed(
-                runners, self.old_runner, self.outputs, x)
 
-        # 获取当前输出节点列表
-        current_outputs = set(self.outputs.keys())
+        # 每个节点图只构建一次执行计划，合并了重复的节点后重新构建
+        plan = execution_tools.ExecutionPlan(runners)
+        aliases = execution_tools.eliminate_common_subexpressions(plan)
+        if len(aliases) > 0:
+            plan = execution_tools.ExecutionPlan(runners)
+
+        # 按拓扑序一次性删除已更改节点及其下游节点的缓存输出，得到当前可复用的输出节点集合
+        invalidate_start = time.perf_counter()
+        current_outputs = execution_tools.invalidate_changed_outputs(
+            plan, self.old_runner, self.outputs)
+        if trace is not None:
+            trace.complete("invalidate_changed_outputs", "executor",
+                           invalidate_start, time.perf_counter())
         # 删除输出节点 UI 列表中已经不存在的输出节点
         for x in list(self.outputs_ui.keys()):
             if x not in current_outputs:
@@ -103,34 +159,67 @@ class RunnerExecutor:
                 del d
 
         # 如果节点图有客户端 ID，则发送 “execution_cached” 消息
-        if self.server.client_id is not None:
+        if self.client_id is not None:
             self.server.send_sync("execution_cached", {"nodes": list(
-                current_outputs), "runner_id": runner_id}, self.server.client_id)
+                current_outputs), "runner_id": runner_id}, self.client_id)
 
         # 初始化已执行节点集合、输出节点 ID 和待执行节点列表
         executed = set()
-        output_node_id = None
-        to_execute = []
-        for node_id in list(execute_outputs):
-            to_execute += [(0, node_id)]
-
-        # 循环执行待执行节点列表中的节点
-        while len(to_execute) > 0:
-            # 总是先执行依赖于未执行节点最少的输出节点
-            to_execute = sorted(list(map(lambda a: (
-                len(execution_tools.recursive_will_execute(runners, self.outputs, a[-1])), a[-1]), to_execute)))
-            output_node_id = to_execute.pop(0)[-1]
-
-            # 递归执行输出节点的执行方法
-            success, error, ex = execution_tools.recursive_execute(
-                self.server, runners, self.outputs, output_node_id, extra_data, executed, runner_id, self.outputs_ui, self.object_storage)
+
+        # 并行模式：就绪的节点直接分发到线程池，下游节点在输入完成后释放
+        if self.pool is not None:
+            success, error, ex = execution_tools.execute_plan_parallel(
+                self.server, plan, self.outputs, execute_outputs, extra_data, executed, runner_id, self.outputs_ui, self.instance_pool, self.pool, self.process_pool, self.output_cache, cancellation_token, self.profile)
+            if success is not True:
+                self.handle_execution_error(
+                    runner_id, runners, current_outputs, executed, error, ex)
+            self.finish_execution(runners, runner_id, executed, aliases, success)
+            return
+
+        # 总是先执行依赖于未执行节点最少的输出节点，剩余依赖数随节点执行增量更新
+        scheduler = execution_tools.OutputScheduler(
+            plan, self.outputs, execute_outputs)
+
+        # 循环执行待执行的输出节点
+        success = True
+        while True:
+            output_node_id = scheduler.pop()
+            if output_node_id is None:
+                break
+
+            # 按执行计划迭代执行输出节点及其上游节点
+            success, error, ex = execution_tools.execute_plan(
+                self.server, plan, self.outputs, output_node_id, extra_data, executed, runner_id, self.outputs_ui, self.instance_pool, self.process_pool, self.output_cache, cancellation_token, self.profile)
             # 如果执行失败，则处理执行错误
             if success is not True:
                 self.handle_execution_error(
                     runner_id, runners, current_outputs, executed, error, ex)
                 break
+            scheduler.output_executed(output_node_id)
+
+        self.finish_execution(runners, runner_id, executed, aliases, success)
+
+    def finish_execution(self, runners, runner_id, executed, aliases, success=True):
+        # 没有被下游节点读完的流式输出在这里展开，之后的执行只会看到普通的输出。
+        # 执行失败时不再运行上游生成器，未结束的流直接关闭并丢弃
+        execution_tools.materialize_streams(self.outputs, self.outputs_ui, drain=success)
+
+        # 被合并的节点共享保留节点的结果
+        for x, representative in aliases.items():
+            if representative in self.outputs:
+                self.outputs[x] = self.outputs[representative]
+                if representative in self.outputs_ui:
+                    self.outputs_ui[x] = self.outputs_ui[representative]
+                executed.add(x)
 
-        # 将已执行节点的状态更新到旧节点字典中
+        # 记录已执行节点的指纹，下次执行时据此判断节点是否更改
         for x in executed:
-            self.old_runner[x] = copy.deepcopy(runners[x])
-        self.server.last_node_id = None
+            self.old_runner[x] = execution_tools.fingerprint_node(runners[x])
+        self.server.set_executing_node(runner_id, self.client_id, None)
+
+        # 每个 runner 结束后发送一次所有节点的 profile
+        self.profile.finish()
+        if self.client_id is not None:
+            mes = self.profile.summary()
+            mes["runner_id"] = runner_id
+            self.server.send_sync("profile", mes, self.client_id)
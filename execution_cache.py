@@ -0,0 +1,406 @@
+import threading
+import collections
+import sys
+import os
+import pickle
+import tempfile
+import nodes
+
+
+def estimate_size(value):
+    """
+    估算一个对象占用的字节数，会遍历 list、tuple、set 和 dict 中的元素。
+
+    Args:
+        value (Any): 要估算的对象。
+
+    Returns:
+        int: 估算的字节数。
+    """
+    size = 0
+    seen = set()
+    stack = [value]
+    while len(stack) > 0:
+        x = stack.pop()
+        if id(x) in seen:
+            continue
+        seen.add(id(x))
+        size += sys.getsizeof(x)
+        if isinstance(x, dict):
+            stack.extend(x.keys())
+            stack.extend(x.values())
+        elif isinstance(x, (list, tuple, set, frozenset)):
+            stack.extend(x)
+    return size
+
+
+class DiskOutputCache:
+    """
+    磁盘上的节点输出缓存，服务重启后依然有效。
+
+    每个缓存键对应目录中的一个 pickle 文件，先写入临时文件再用 os.replace 替换，
+    保证不会读到写了一半的文件。总大小超过上限时按最近访问时间淘汰。
+
+    目录中的 FORMAT_FILE 记录缓存格式的版本，与 FORMAT_VERSION 不一致（例如缓存键的计算方式改变）时
+    清空整个目录中的缓存文件。
+    """
+
+    SUFFIX = ".pkl"
+    FORMAT_FILE = "FORMAT_VERSION"
+    # 缓存键或 pickle 内容的格式改变时加一
+    FORMAT_VERSION = "2"
+
+    def __init__(self, directory, max_bytes=1024 * 1024 * 1024):
+        self.mutex = threading.RLock()
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # 缓存键 -> 文件字节数
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(directory, exist_ok=True)
+        self.check_format()
+
+        # 按最近访问时间从旧到新加载已有的缓存文件
+        files = []
+        for name in os.listdir(directory):
+            # 上次进程退出时没有写完的临时文件
+            if name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+                continue
+            if not name.endswith(self.SUFFIX):
+                continue
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            files.append((stat.st_mtime, name[: -len(self.SUFFIX)], stat.st_size))
+        for _, key, size in sorted(files):
+            self.entries[key] = size
+            self.size += size
+        self.evict()
+
+    def check_format(self):
+        # 格式版本不一致（或旧版本没有记录版本）时删除所有缓存文件，再写入当前版本
+        path = os.path.join(self.directory, self.FORMAT_FILE)
+        try:
+            with open(path, "r") as f:
+                version = f.read().strip()
+        except OSError:
+            version = None
+        if version == self.FORMAT_VERSION:
+            return
+        print(f"Clearing disk output cache {self.directory}: format {version} != {self.FORMAT_VERSION}")
+        for name in os.listdir(self.directory):
+            if name.endswith(self.SUFFIX) or name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+        with open(path, "w") as f:
+            f.write(self.FORMAT_VERSION)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + self.SUFFIX)
+
+    def get(self, key):
+        with self.mutex:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            path = self.get_path(key)
+            try:
+                with open(path, "rb") as f:
+                    value = pickle.load(f)
+                # 用修改时间记录最近访问时间，重启后据此恢复 LRU 顺序
+                os.utime(path)
+            except Exception as e:
+                print(f"Failed to load cached output {key}:", e)
+                self.remove(key)
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            # 无法序列化的输出只保存在内存中
+            return
+        with self.mutex:
+            if len(data) > self.max_bytes:
+                return
+            # 写入失败（没有权限、磁盘已满等）只影响缓存，不会让已经执行完的节点失败
+            tmp_path = None
+            try:
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.get_path(key))
+            except OSError as e:
+                print(f"Failed to save cached output {key}:", e)
+                if tmp_path is not None:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+                return
+            self.size -= self.entries.pop(key, 0)
+            self.entries[key] = len(data)
+            self.size += len(data)
+            self.evict()
+
+    def remove(self, key):
+        with self.mutex:
+            self.size -= self.entries.pop(key, 0)
+            try:
+                os.remove(self.get_path(key))
+            except OSError:
+                pass
+
+    def evict(self):
+        with self.mutex:
+            while self.size > self.max_bytes and len(self.entries) > 0:
+                key = next(iter(self.entries))
+                self.remove(key)
+                self.evictions += 1
+
+    def stats(self):
+        with self.mutex:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class OutputCache:
+    """
+    按内容寻址的节点输出缓存，在所有 runner 和客户端之间共享。
+
+    键是节点的缓存键（由 class_type、字面量输入、上游缓存键和 IS_CHANGED 的值计算得到），
+    值是节点的 (output_data, output_ui)。超过条目数或字节数上限时按 LRU 淘汰。
+    如果提供了 disk_cache，内存中未命中时再查找磁盘缓存，写入时同时写入磁盘。
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024, disk_cache=None):
+        self.mutex = threading.RLock()
+        self.disk_cache = disk_cache
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict()  # 缓存键 -> (值, 字节数)
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        # 命中时把条目移到最近使用的位置
+        with self.mutex:
+            entry = self.entries.get(key, None)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[0]
+            self.misses += 1
+
+        if self.disk_cache is None:
+            return None
+        value = self.disk_cache.get(key)
+        if value is not None:
+            self.put(key, value, write_disk=False)
+        return value
+
+    def put(self, key, value, write_disk=True):
+        if write_disk and self.disk_cache is not None:
+            self.disk_cache.put(key, value)
+        size = estimate_size(value)
+        with self.mutex:
+            # 单个条目超过字节上限时不缓存
+            if size > self.max_bytes:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self.entries[key] = (value, size)
+            self.size += size
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                _, (_, evicted_size) = self.entries.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self.mutex:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.mutex:
+            stats = {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+        if self.disk_cache is not None:
+            stats["disk"] = self.disk_cache.stats()
+        return stats
+
+
+class ValidationCache:
+    """
+    按节点图的规范哈希缓存验证结果，重复提交相同的节点图时不再重新验证。
+
+    值是 (验证结果, 节点 ID -> 验证后的输入)，验证时写回的类型转换和常量折叠的结果在命中时重新应用。
+    超过条目数上限时按 LRU 淘汰。
+    """
+
+    def __init__(self, max_entries=256):
+        self.mutex = threading.Lock()
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # 节点图哈希 -> (验证结果, 验证后的输入)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.mutex:
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, value):
+        with self.mutex:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.mutex:
+            self.entries.clear()
+
+    def stats(self):
+        with self.mutex:
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+class NodeInstancePool:
+    """
+    按 class_type 复用的节点实例池。
+
+    执行节点时从池中取出一个空闲实例，执行完毕后放回，同一类型的多个节点共享预热好的实例，
+    并行执行的节点各自拿到不同的实例。新建实例后会调用它的 setup()，实例被淘汰时调用 teardown()，
+    节点可以在其中创建和释放客户端、模型、SMTP 会话等昂贵的资源。
+    空闲实例总数超过上限时按 LRU 淘汰。
+    """
+
+    def __init__(self, max_idle=32):
+        self.mutex = threading.RLock()
+        self.max_idle = max_idle
+        self.idle = {}  # class_type -> 空闲实例列表
+        self.lru = collections.OrderedDict()  # id(实例) -> (class_type, 实例)，按最近放回的顺序
+        self.in_use = 0
+        self.created = 0
+        self.reused = 0
+        self.evictions = 0
+
+    def acquire(self, class_type):
+        """
+        取出一个 class_type 的空闲实例，没有时新建一个并调用 setup()。
+        """
+        with self.mutex:
+            instances = self.idle.get(class_type, None)
+            if instances:
+                obj = instances.pop()
+                del self.lru[id(obj)]
+                self.in_use += 1
+                self.reused += 1
+                return obj
+            self.in_use += 1
+            self.created += 1
+
+        try:
+            obj = nodes.NODE_CLASS_MAPPINGS[class_type]()
+            if hasattr(obj, "setup"):
+                obj.setup()
+        except BaseException:
+            with self.mutex:
+                self.in_use -= 1
+            raise
+        return obj
+
+    def release(self, class_type, obj):
+        """
+        把用完的实例放回池中，空闲实例过多时淘汰最久未使用的实例。
+        """
+        evicted = []
+        with self.mutex:
+            self.in_use -= 1
+            self.idle.setdefault(class_type, []).append(obj)
+            self.lru[id(obj)] = (class_type, obj)
+            while len(self.lru) > self.max_idle:
+                _, (evicted_type, evicted_obj) = self.lru.popitem(last=False)
+                self.idle[evicted_type].remove(evicted_obj)
+                if len(self.idle[evicted_type]) == 0:
+                    del self.idle[evicted_type]
+                evicted.append(evicted_obj)
+                self.evictions += 1
+        for x in evicted:
+            self.teardown(x)
+
+    def discard(self, class_type, obj):
+        """
+        丢弃一个不能再复用的实例，例如超时后可能还在后台线程中使用的实例，不会调用 teardown()。
+        """
+        with self.mutex:
+            self.in_use -= 1
+
+    def teardown(self, obj):
+        if hasattr(obj, "teardown"):
+            try:
+                obj.teardown()
+            except Exception as e:
+                print(f"Failed to tear down {type(obj).__name__}:", e)
+
+    def clear(self):
+        with self.mutex:
+            instances = [x for _, x in self.lru.values()]
+            self.idle.clear()
+            self.lru.clear()
+        for x in instances:
+            self.teardown(x)
+
+    def stats(self):
+        with self.mutex:
+            return {
+                "idle": len(self.lru),
+                "max_idle": self.max_idle,
+                "in_use": self.in_use,
+                "created": self.created,
+                "reused": self.reused,
+                "evictions": self.evictions,
+            }
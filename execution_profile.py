@@ -0,0 +1,173 @@
+import os
+import threading
+import time
+import tracemalloc
+import execution_cache
+
+
+class RunnerProfile:
+    """
+    记录一次 runner 执行中每个节点的耗时、内存和输出大小。
+
+    每个节点记录：
+        wall_time: 节点从开始执行到结束的时间（秒）。
+        cpu_time: 执行节点的线程消耗的 CPU 时间（秒），不包括进程池和异步事件循环中的时间。
+        input_wait_time: 等待输入的时间（秒），包括读取上游流式输出的时间，
+            以及并行模式下节点就绪后在线程池中排队的时间。
+        memory_peak: 节点执行期间新增的内存峰值（字节），只在开启 trace_memory 时记录，
+            多个节点并行执行时互相包含，只能作为参考。
+        output_size: 估算的输出字节数。
+        cached: 输出是否来自共享的输出缓存。
+        error: 节点是否执行失败。
+    """
+
+    def __init__(self, trace_memory=False, trace=None):
+        self.mutex = threading.Lock()
+        self.trace_memory = trace_memory
+        self.trace = trace  # 不为 None 时同时把每个节点写入 RunnerTrace
+        self.start_time = time.perf_counter()
+        self.end_time = None
+        self.ready_times = {}  # 节点 ID -> 节点所有输入就绪的时间
+        self.nodes = {}  # 节点 ID -> 节点的记录
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def node_ready(self, unique_id):
+        with self.mutex:
+            self.ready_times[unique_id] = time.perf_counter()
+
+    def begin(self, unique_id, class_type):
+        """
+        开始记录一个节点，返回传给 inputs_ready 和 end 的记录。
+        """
+        now = time.perf_counter()
+        with self.mutex:
+            ready_time = self.ready_times.pop(unique_id, now)
+        record = {
+            "node_id": unique_id,
+            "class_type": class_type,
+            "start": now,
+            "cpu_start": time.thread_time(),
+            "input_wait_time": now - ready_time,
+            "memory_start": None,
+        }
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            record["memory_start"] = tracemalloc.get_traced_memory()[0]
+        return record
+
+    def inputs_ready(self, record):
+        record["inputs_ready"] = time.perf_counter()
+        record["input_wait_time"] += record["inputs_ready"] - record["start"]
+
+    def end(self, record, output_data=None, cached=False, error=False):
+        memory_peak = None
+        if record["memory_start"] is not None:
+            memory_peak = max(0, tracemalloc.get_traced_memory()[1] - record["memory_start"])
+        output_size = None
+        if isinstance(output_data, (list, tuple)):
+            output_size = execution_cache.estimate_size(output_data)
+        end = time.perf_counter()
+        if self.trace is not None:
+            args = {"node_id": record["node_id"], "cached": cached, "error": error}
+            self.trace.complete(
+                record["class_type"], "node", record["start"], end, args
+            )
+            # 输入就绪之后的部分是节点 FUNCTION 的调用（或缓存查找）
+            if "inputs_ready" in record:
+                self.trace.complete(
+                    "FUNCTION", "node", record["inputs_ready"], end, args
+                )
+        with self.mutex:
+            self.nodes[record["node_id"]] = {
+                "class_type": record["class_type"],
+                "wall_time": end - record["start"],
+                "cpu_time": time.thread_time() - record["cpu_start"],
+                "input_wait_time": record["input_wait_time"],
+                "memory_peak": memory_peak,
+                "output_size": output_size,
+                "cached": cached,
+                "error": error,
+            }
+
+    def finish(self):
+        self.end_time = time.perf_counter()
+        if self.trace is not None:
+            self.trace.complete("runner", "executor", self.start_time, self.end_time)
+
+    def summary(self):
+        # 返回可以直接用 JSON 发送的结果
+        with self.mutex:
+            end_time = self.end_time if self.end_time is not None else time.perf_counter()
+            return {
+                "total_time": end_time - self.start_time,
+                "nodes": {x: dict(v) for x, v in self.nodes.items()},
+            }
+
+
+class RunnerTrace:
+    """
+    以 Chrome/Perfetto trace-event JSON 格式记录一次 runner 执行的时间线，
+    可以直接在 chrome://tracing 或 ui.perfetto.dev 中打开。
+
+    时间使用 time.perf_counter() 的秒数，导出时转换为微秒。
+    """
+
+    # 没有对应线程的事件（例如在队列中等待）使用的 tid
+    QUEUE_TID = 0
+
+    def __init__(self, runner_id):
+        self.mutex = threading.Lock()
+        self.runner_id = runner_id
+        self.pid = os.getpid()
+        self.events = []
+        self.thread_names = {self.QUEUE_TID: "queue"}
+
+    def complete(self, name, cat, start, end, args=None, tid=None):
+        """
+        记录一个从 start 到 end 的完整事件，tid 为 None 时使用当前线程。
+        """
+        thread_name = None
+        if tid is None:
+            thread = threading.current_thread()
+            tid = thread.ident
+            thread_name = thread.name
+        event = {
+            "name": name,
+            "cat": cat,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": max(0, end - start) * 1e6,
+            "pid": self.pid,
+            "tid": tid,
+        }
+        if args is not None:
+            event["args"] = args
+        with self.mutex:
+            if thread_name is not None and tid not in self.thread_names:
+                self.thread_names[tid] = thread_name
+            self.events.append(event)
+
+    def to_json(self):
+        with self.mutex:
+            events = list(self.events)
+            thread_names = dict(self.thread_names)
+        metadata = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "args": {"name": f"runner {self.runner_id}"},
+            }
+        ]
+        for tid, name in thread_names.items():
+            metadata.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": self.pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        return {"traceEvents": metadata + events, "displayTimeUnit": "ms"}
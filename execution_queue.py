@@ -1,6 +1,16 @@
 import threading
+import time
 import copy
+import collections
 import heapq  # 堆队列算法
+import execution_tools
+import execution_profile
+import internal.utils
+
+# 保留的错误快照数量，快照引用了出错时所有节点的输出，不能无限保留
+MAX_ERROR_SNAPSHOTS = 16
+# 保留的执行时间线数量
+MAX_TRACES = 16
 
 class RunnerQueue:
     def __init__(self, server):
@@ -12,12 +22,17 @@ class RunnerQueue:
         self.queue = []  # 任务队列，用于存储待执行的任务
         self.currently_running = {}  # 当前正在执行的任务，用于存储任务 ID 和任务信息
         self.history = {}  # 执行历史记录，用于存储已执行的任务信息
+        self.error_snapshots = collections.OrderedDict()  # 任务 ID -> 出错时的快照
+        self.cancellation_tokens = {}  # 正在执行的任务编号 -> 取消令牌
+        self.enqueue_times = {}  # 任务 ID -> 加入队列的时间
+        self.traces = collections.OrderedDict()  # 任务 ID -> 执行时间线
         server.runner_queue = self  # 将当前 RunnerQueue 实例保存到 server 实例中
 
     def put(self, item):
         # 将任务添加到任务队列中
         with self.mutex:
             heapq.heappush(self.queue, item)  # 使用堆来维护任务队列
+            self.enqueue_times[item[1]] = time.perf_counter()  # 记录加入队列的时间
             self.server.queue_updated()  # 通知 server 队列已更新
             self.not_empty.notify()  # 通知等待的线程队列不再为空
 
@@ -29,19 +44,74 @@ class RunnerQueue:
             item = heapq.heappop(self.queue)  # 从队列中获取任务
             i = self.task_counter  # 生成任务 ID
             self.currently_running[i] = copy.deepcopy(item)  # 将任务信息保存到当前正在执行的任务中
+            self.cancellation_tokens[i] = internal.utils.CancellationToken()  # 为任务创建取消令牌
+            enqueue_time = self.enqueue_times.pop(item[1], None)
+            # extra_data 中 trace 为 True 的任务记录执行时间线，从在队列中等待开始
+            if item[3].get("trace", False):
+                trace = execution_profile.RunnerTrace(item[1])
+                if enqueue_time is not None:
+                    trace.complete(
+                        "queue wait",
+                        "queue",
+                        enqueue_time,
+                        time.perf_counter(),
+                        tid=execution_profile.RunnerTrace.QUEUE_TID,
+                    )
+                self.traces[item[1]] = trace
+                while len(self.traces) > MAX_TRACES:
+                    self.traces.popitem(last=False)
             self.task_counter += 1  # 更新任务计数器
             self.server.queue_updated()  # 通知 server 队列已更新
             return (item, i)  # 返回任务信息和任务 ID
 
-    def task_done(self, item_id, outputs):
-        # 标记任务已完成，并保存任务执行结果
+    def task_done(self, item_id, outputs, error_snapshot=None, profile=None):
+        # 标记任务已完成，并保存任务执行结果和每个节点的 profile
         with self.mutex:
             runner = self.currently_running.pop(item_id)  # 从当前正在执行的任务中删除任务信息
-            self.history[runner[1]] = {"runner": runner, "outputs": {}}  # 将任务信息保存到历史记录中
+            self.cancellation_tokens.pop(item_id, None)
+            self.history[runner[1]] = {"runner": runner, "outputs": {}, "profile": profile}  # 将任务信息保存到历史记录中
             for o in outputs:
                 self.history[runner[1]]["outputs"][o] = outputs[o]  # 将任务执行结果保存到历史记录中
+            if error_snapshot is not None:
+                self.error_snapshots[runner[1]] = error_snapshot  # 保存出错时的快照，按需格式化
+                while len(self.error_snapshots) > MAX_ERROR_SNAPSHOTS:
+                    self.error_snapshots.popitem(last=False)
             self.server.queue_updated()  # 通知 server 队列已更新
 
+    def get_cancellation_token(self, item_id):
+        # 获取正在执行的任务的取消令牌
+        with self.mutex:
+            return self.cancellation_tokens.get(item_id, None)
+
+    def interrupt(self, runner_id=None, client_id=None):
+        # 中断正在执行的任务，按 runner_id 中断一个任务，或中断 client_id 提交的所有任务，返回是否有任务被中断
+        if runner_id is None and client_id is None:
+            return False
+        with self.mutex:
+            interrupted = False
+            for i, item in self.currently_running.items():
+                if runner_id is not None:
+                    if item[1] != runner_id:
+                        continue
+                elif item[3].get("client_id", None) != client_id:
+                    continue
+                self.cancellation_tokens[i].cancel()
+                interrupted = True
+            return interrupted
+
+    def get_trace(self, runner_id):
+        # 获取任务的执行时间线，没有记录时返回 None
+        with self.mutex:
+            return self.traces.get(runner_id, None)
+
+    def get_error_snapshot(self, runner_id):
+        # 获取任务出错时的完整快照，不存在时返回 None
+        with self.mutex:
+            snapshot = self.error_snapshots.get(runner_id, None)
+        if snapshot is None:
+            return None
+        return execution_tools.format_error_snapshot(snapshot)
+
     def get_current_queue(self):
         # 获取当前正在执行的任务和任务队列
         with self.mutex:
@@ -59,6 +129,7 @@ class RunnerQueue:
         # 清空任务队列
         with self.mutex:
             self.queue = []  # 将任务队列清空
+            self.enqueue_times.clear()
             self.server.queue_updated()  # 通知 server 队列已更新
 
     def delete_queue_item(self, function):
@@ -66,6 +137,7 @@ class RunnerQueue:
         with self.mutex:
             for x in range(len(self.queue)):
                 if function(self.queue[x]):
+                    self.enqueue_times.pop(self.queue[x][1], None)
                     if len(self.queue) == 1:
                         self.wipe_queue()  # 如果队列中只有一个任务，则清空队列
                     else:
@@ -89,8 +161,12 @@ class RunnerQueue:
         # 清空历史记录
         with self.mutex:
             self.history = {}  # 将历史记录清空
+            self.error_snapshots.clear()
+            self.traces.clear()
 
     def delete_history_item(self, id_to_delete):
         # 删除指定的历史记录
         with self.mutex:
-            self.history.pop(id_to_delete, None)  # 删除指定任务的历史记录
\ No newline at end of file
+            self.history.pop(id_to_delete, None)  # 删除指定任务的历史记录
+            self.error_snapshots.pop(id_to_delete, None)
+            self.traces.pop(id_to_delete, None)
\ No newline at end of file
@@ -1,9 +1,81 @@
 import nodes
+import node_schema
+import internal.utils
+import execution_cache
 import traceback
+import copy
 import sys
+import collections
+import collections.abc
+import itertools
+import functools
+import heapq
+import concurrent.futures
+import asyncio
+import inspect
+import contextvars
+import reprlib
+import threading
+import hashlib
+import json
+import math
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+# 验证结果缓存，None 表示不缓存
+validation_cache = execution_cache.ValidationCache()
+
+
+def set_validation_cache_entries(max_entries):
+    global validation_cache
+    validation_cache = None
+    if max_entries > 0:
+        validation_cache = execution_cache.ValidationCache(max_entries)
 
 
 def validate_runner(runner):
+    """
+    验证节点图，验证时会把类型转换和常量折叠的结果写回节点的输入。
+
+    完全通过的结果按节点图的规范哈希缓存，重新提交相同的节点图时只需计算一次哈希，
+    缓存中验证后的输入会重新写回 runner。失败的结果和包含 VALIDATE_INPUTS 节点的节点图不缓存，
+    因为自定义验证可能依赖文件、模型等节点图之外的状态。
+
+    Args:
+        runner (dict): 节点图的节点字典。
+
+    Returns:
+        tuple: (是否通过, 错误信息, 要执行的输出节点 ID 列表, 节点错误信息字典)。
+    """
+    cache = validation_cache
+    if cache is None or any(
+        hasattr(nodes.NODE_CLASS_MAPPINGS.get(node["class_type"], None), "VALIDATE_INPUTS")
+        for node in runner.values()
+    ):
+        return validate_runner_uncached(runner)
+
+    key = hash_value([node_schema.REGISTRY_VERSION, runner])
+    entry = cache.get(key)
+    if entry is not None:
+        result, inputs = copy.deepcopy(entry)
+        for x, v in inputs.items():
+            runner[x]["inputs"] = v
+        return result
+
+    result = validate_runner_uncached(runner)
+    # 有输出节点验证失败时不缓存，修正节点图之外的问题后重新提交可以通过
+    if result[0] is True and len(result[3]) == 0:
+        inputs = {x: node["inputs"] for x, node in runner.items()}
+        cache.put(key, copy.deepcopy((result, inputs)))
+    return result
+
+
+def validate_runner_uncached(runner):
     # 初始化输出节点集合
     outputs = set()
     # 遍历 runner 中的所有节点
@@ -30,19 +102,46 @@ def validate_runner(runner):
     node_errors = {}
     validated = {}
 
-    # 遍历输出节点集合中的所有节点
-    for o in outputs:
-        valid = False
-        reasons = []
+    # 按执行计划的拓扑序逐个验证，上游节点总是先于下游节点，不再递归，很深的节点链也不会溢出栈
+    plan = ExecutionPlan(runner)
+    cycle = plan.cycle_nodes()
+    # 只验证输出节点及其上游节点，一次反向遍历标记所有需要验证的节点
+    to_validate = set(outputs)
+    stack = list(outputs)
+    while len(stack) > 0:
+        unique_id = stack.pop()
+        for input_unique_id in plan.dependencies[unique_id]:
+            if input_unique_id not in to_validate:
+                to_validate.add(input_unique_id)
+                stack.append(input_unique_id)
+
+    for unique_id in to_validate:
+        if unique_id in cycle:
+            validated[unique_id] = (
+                False,
+                [
+                    {
+                        "type": "runner_invalid_cycle",
+                        "message": "节点处于循环依赖中",
+                        "details": f"{unique_id}",
+                        "extra_info": {"cycle": sorted(cycle)},
+                    }
+                ],
+                unique_id,
+            )
+        elif unique_id not in plan.position:
+            # 依赖循环中节点的节点无法验证，错误记录在循环中的节点上
+            validated[unique_id] = (False, [], unique_id)
+
+    for unique_id in plan.order:
+        if unique_id not in to_validate:
+            continue
         try:
             # 验证节点的输入参数是否合法
-            m = validate_inputs(runner, o, validated)
-            valid = m[0]
-            reasons = m[1]
+            validate_inputs(runner, unique_id, validated)
         except Exception as ex:
             # 如果验证过程中出现异常，则记录异常信息
             typ, _, tb = sys.exc_info()
-            valid = False
             exception_type = full_type_name(typ)
             reasons = [
                 {
@@ -55,22 +154,33 @@ def validate_runner(runner):
                     },
                 }
             ]
-            validated[o] = (False, reasons, o)
+            validated[unique_id] = (False, reasons, unique_id)
+
+    # 有输出节点验证失败时，才计算每个节点上游（包括自身）中有错误信息的节点
+    error_sources = {}
+    if any(validated[o][0] is not True for o in outputs):
+        error_sources = find_error_sources(plan, to_validate, validated)
+
+    # 遍历输出节点集合中的所有节点
+    for o in outputs:
+        valid = validated[o][0]
+        reasons = validated[o][1]
 
         # 如果节点输入参数合法，则将该节点加入合法输出节点集合
         if valid is True:
             good_outputs.add(o)
         else:
-            # 如果节点输入参数不合法，则记录错误信息，并将该节点及其依赖节点加入节点错误信息字典
+            # 如果节点输入参数不合法，则记录错误信息，并将该节点的上游节点中有错误的节点加入节点错误信息字典
             print(f"Failed to validate runner for output {o}:")
             if len(reasons) > 0:
                 print("* (runner):")
                 for reason in reasons:
                     print(f"  - {reason['message']}: {reason['details']}")
             errors += [(o, reasons)]
-            for node_id, result in validated.items():
-                valid = result[0]
-                reasons = result[1]
+            last = len(plan.order)
+            for node_id in sorted(error_sources[o], key=lambda x: plan.position.get(x, last)):
+                valid = validated[node_id][0]
+                reasons = validated[node_id][1]
                 # 如果节点的上游节点有错误，则该节点也会被标记为无效，但是不会有错误信息附加在该节点上
                 # 因此，在返回节点错误信息字典时，不应该包含这些节点
                 if valid is not True and len(reasons) > 0:
@@ -104,10 +214,138 @@ def validate_runner(runner):
 
         return (False, error, list(good_outputs), node_errors)
 
+    # 把只依赖字面量的纯节点提前求值，结果作为字面量写入下游节点的输入
+    fold_constants(runner, [x for x, v in validated.items() if v[0] is True])
+
     # 如果所有输出节点都合法，则返回验证通过的信息和节点错误信息字典
     return (True, None, list(good_outputs), node_errors)
 
 
+def find_error_sources(plan, to_validate, validated):
+    """
+    沿拓扑序把有错误信息的节点向下游传播，得到每个节点上游（包括自身）中有错误信息的节点。
+
+    Args:
+        plan (ExecutionPlan): 节点图的执行计划。
+        to_validate (set): 验证过的节点 ID 集合。
+        validated (dict): 节点 ID -> 验证结果。
+
+    Returns:
+        dict: 节点 ID -> 有错误信息的节点 ID 集合。
+    """
+
+    def has_errors(unique_id):
+        return validated[unique_id][0] is not True and len(validated[unique_id][1]) > 0
+
+    error_sources = {}
+    for unique_id in plan.order:
+        if unique_id not in to_validate:
+            continue
+        dependencies = plan.dependencies[unique_id]
+        if not has_errors(unique_id) and len(dependencies) == 1:
+            # 只有一个上游节点时共享它的集合，长链上不复制
+            error_sources[unique_id] = error_sources[dependencies[0]]
+            continue
+        sources = set()
+        if has_errors(unique_id):
+            sources.add(unique_id)
+        for input_unique_id in dependencies:
+            sources |= error_sources[input_unique_id]
+        error_sources[unique_id] = sources
+
+    # 处于循环中或依赖循环的节点没有拓扑位置，逐个遍历它们的上游节点
+    for unique_id in to_validate:
+        if unique_id in plan.position:
+            continue
+        sources = set()
+        seen = {unique_id}
+        stack = [unique_id]
+        while len(stack) > 0:
+            x = stack.pop()
+            if x in error_sources:
+                sources |= error_sources[x]
+                continue
+            if has_errors(x):
+                sources.add(x)
+            for input_unique_id in plan.dependencies[x]:
+                if input_unique_id not in seen:
+                    seen.add(input_unique_id)
+                    stack.append(input_unique_id)
+        error_sources[unique_id] = sources
+    return error_sources
+
+
+def is_literal_value(value):
+    # 可以直接写入节点图并序列化为标准 JSON 的值
+    if isinstance(value, float):
+        return math.isfinite(value)
+    return isinstance(value, (str, int, bool))
+
+
+# 常量折叠时每个节点求值的时限（秒）
+FOLD_CONSTANT_TIMEOUT = 0.5
+
+
+def fold_constants(runner, valid_nodes):
+    """
+    在提交时对常量子图做常量折叠。
+
+    声明了 PURE 的节点如果所有输入都是字面量（或已经折叠的上游纯节点），就在这里直接求值，
+    并把结果作为字面量写入下游节点的输入，执行时下游节点不再依赖它。
+    输出节点执行时总会运行，不在这里求值，否则会运行两次。每个节点的求值都有 FOLD_CONSTANT_TIMEOUT 的时限，
+    超时的节点留到执行时再运行。
+
+    Args:
+        runner (dict): 节点图，会被直接修改。
+        valid_nodes (list): 通过验证的节点 ID 列表，只折叠这些节点。
+
+    Returns:
+        dict: 折叠的节点 ID -> 每个输出槽位的字面量值。
+    """
+    valid_nodes = set(valid_nodes)
+    plan = ExecutionPlan(runner)
+    constants = {}
+    for unique_id in plan.order:
+        if unique_id not in valid_nodes:
+            continue
+        inputs = runner[unique_id]["inputs"]
+        for x, v in inputs.items():
+            if isinstance(v, list) and v[0] in constants and v[1] < len(constants[v[0]]):
+                inputs[x] = constants[v[0]][v[1]]
+
+        class_def = nodes.NODE_CLASS_MAPPINGS[runner[unique_id]["class_type"]]
+        if not (hasattr(class_def, "PURE") and class_def.PURE == True):
+            continue
+        if hasattr(class_def, "OUTPUT_NODE") and class_def.OUTPUT_NODE == True:
+            continue
+        schema = node_schema.get_schema(class_def)
+        if any(schema.output_is_list) or schema.has_hidden:
+            continue
+        if any(isinstance(v, list) for v in inputs.values()):
+            continue
+
+        # 在验证线程中求值，节点自己的 TIMEOUT 和 FOLD_CONSTANT_TIMEOUT 取较短的一个作为时限
+        timeout = FOLD_CONSTANT_TIMEOUT
+        if getattr(class_def, "TIMEOUT", None) is not None:
+            timeout = min(timeout, class_def.TIMEOUT)
+        internal.utils.set_node_deadline(time.monotonic() + timeout)
+        try:
+            input_data_all = get_input_data(inputs, class_def, unique_id, {}, runner)
+            output_data, _ = get_output_data(class_def(), input_data_all)
+        except Exception as ex:
+            # 求值失败或超时的节点留到执行时再运行并报告错误
+            print(f"Failed to fold constant node {unique_id}:", ex)
+            continue
+        finally:
+            internal.utils.set_node_deadline(None)
+        if isinstance(output_data, NodeOutputStream):
+            continue
+        if any(len(o) != 1 or not is_literal_value(o[0]) for o in output_data):
+            continue
+        constants[unique_id] = [o[0] for o in output_data]
+    return constants
+
+
 def full_type_name(klass):
     module = klass.__module__
     if module == "builtins":
@@ -115,9 +353,19 @@ def full_type_name(klass):
     return module + "." + klass.__qualname__
 
 
+def is_valid_choice(val, choices):
+    """
+    判断值是否是枚举输入的候选值之一，不可哈希的值不会在集合中。
+    """
+    try:
+        return val in choices
+    except TypeError:
+        return False
+
+
 def validate_inputs(runner, item, validated):
     """
-    根据节点的提示和类类型验证节点的输入。
+    根据节点的提示和类类型验证节点的输入。链接的上游节点必须已经验证过并记录在 validated 中。
 
     Args:
         runner (dict): 运行器对象。
@@ -135,12 +383,13 @@ def validate_inputs(runner, item, validated):
     class_type = runner[unique_id]["class_type"]
     obj_class = nodes.NODE_CLASS_MAPPINGS[class_type]
 
-    class_inputs = obj_class.INPUT_TYPES()
-    required_inputs = class_inputs["required"]
+    required_inputs = node_schema.get_schema(obj_class).required
+    has_custom_validation = hasattr(obj_class, "VALIDATE_INPUTS")
 
     errors = []
     valid = True
 
+    # 第一阶段：逐个输入检查链接、类型转换、最小值和最大值以及枚举值
     for x in required_inputs:
         if x not in inputs:
             error = {
@@ -153,8 +402,9 @@ def validate_inputs(runner, item, validated):
             continue
 
         val = inputs[x]
-        info = required_inputs[x]
-        type_input = info[0]
+        spec = required_inputs[x]
+        info = spec.config
+        type_input = spec.type
         if isinstance(val, list):
             if len(val) != 2:
                 error = {
@@ -172,7 +422,7 @@ def validate_inputs(runner, item, validated):
 
             o_id = val[0]
             o_class_type = runner[o_id]["class_type"]
-            r = nodes.NODE_CLASS_MAPPINGS[o_class_type].RETURN_TYPES
+            r = node_schema.get_schema(nodes.NODE_CLASS_MAPPINGS[o_class_type]).return_types
             if r[val[1]] != type_input:
                 received_type = r[val[1]]
                 details = f"{x}，{received_type} != {type_input}"
@@ -189,43 +439,15 @@ def validate_inputs(runner, item, validated):
                 }
                 errors.append(error)
                 continue
-            try:
-                r = validate_inputs(runner, o_id, validated)
-                if r[0] is False:
-                    # `r` 已经在 `validated[o_id]` 中设置
-                    valid = False
-                    continue
-            except Exception as ex:
-                typ, _, tb = sys.exc_info()
+            # 上游节点已经按拓扑序验证过，其错误记录在 validated[o_id] 中
+            r = validated.get(o_id, None)
+            if r is not None and r[0] is False:
                 valid = False
-                exception_type = full_type_name(typ)
-                reasons = [
-                    {
-                        "type": "exception_during_inner_validation",
-                        "message": "验证内部节点时出现异常",
-                        "details": str(ex),
-                        "extra_info": {
-                            "input_name": x,
-                            "input_config": info,
-                            "exception_message": str(ex),
-                            "exception_type": exception_type,
-                            "traceback": traceback.format_tb(tb),
-                            "linked_node": val,
-                        },
-                    }
-                ]
-                validated[o_id] = (False, reasons, o_id)
                 continue
         else:
             try:
-                if type_input == "INT":
-                    val = int(val)
-                    inputs[x] = val
-                if type_input == "FLOAT":
-                    val = float(val)
-                    inputs[x] = val
-                if type_input == "STRING":
-                    val = str(val)
+                if spec.coercer is not None:
+                    val = spec.coercer(val)
                     inputs[x] = val
             except Exception as ex:
                 error = {
@@ -242,82 +464,81 @@ def validate_inputs(runner, item, validated):
                 errors.append(error)
                 continue
 
-            if len(info) > 1:
-                if "min" in info[1] and val < info[1]["min"]:
-                    error = {
-                        "type": "value_smaller_than_min",
-                        "message": "值 {} 小于最小值 {}".format(val, info[1]["min"]),
-                        "details": f"{x}",
-                        "extra_info": {
-                            "input_name": x,
-                            "input_config": info,
-                            "received_value": val,
-                        },
-                    }
-                    errors.append(error)
-                    continue
-                if "max" in info[1] and val > info[1]["max"]:
+            if spec.min is not None and val < spec.min:
+                error = {
+                    "type": "value_smaller_than_min",
+                    "message": "值 {} 小于最小值 {}".format(val, spec.min),
+                    "details": f"{x}",
+                    "extra_info": {
+                        "input_name": x,
+                        "input_config": info,
+                        "received_value": val,
+                    },
+                }
+                errors.append(error)
+                continue
+            if spec.max is not None and val > spec.max:
+                error = {
+                    "type": "value_bigger_than_max",
+                    "message": "值 {} 大于最大值 {}".format(val, spec.max),
+                    "details": f"{x}",
+                    "extra_info": {
+                        "input_name": x,
+                        "input_config": info,
+                        "received_value": val,
+                    },
+                }
+                errors.append(error)
+                continue
+
+            # 有自定义验证方法的节点由该方法检查枚举值，在所有输入检查完后统一调用
+            if has_custom_validation:
+                continue
+            if spec.choices is not None:
+                if not is_valid_choice(val, spec.choices):
+                    input_config = info
+                    list_info = ""
+
+                    # 不要像它们是大量扫描的模型文件路径那样发送回巨大的列表
+                    if len(type_input) > 20:
+                        list_info = f"(长度为 {len(type_input)} 的列表)"
+                        input_config = None
+                    else:
+                        list_info = str(list(type_input))
+
                     error = {
-                        "type": "value_bigger_than_max",
-                        "message": "值 {} 大于最大值 {}".format(val, info[1]["max"]),
-                        "details": f"{x}",
+                        "type": "value_not_in_list",
+                        "message": "值不在列表中",
+                        "details": f"{x}：'{val}' 不在 {list_info} 中",
                         "extra_info": {
                             "input_name": x,
-                            "input_config": info,
+                            "input_config": input_config,
                             "received_value": val,
                         },
                     }
                     errors.append(error)
                     continue
 
-            # 如果节点有验证输入的自定义方法，则调用该方法
-            if hasattr(obj_class, "VALIDATE_INPUTS"):
-                input_data_all = get_input_data(inputs, obj_class, unique_id)
-                ret = map_node_over_list(obj_class, input_data_all, "VALIDATE_INPUTS")
-
-                for i, r in enumerate(ret):
-                    if r is not True:
-                        details = f"{x}"
-                        if r is not False:
-                            details += f" - {str(r)}"
-
-                        error = {
-                            "type": "custom_validation_failed",
-                            "message": "节点的自定义验证失败",
-                            "details": details,
-                            "extra_info": {
-                                "input_name": x,
-                                "input_config": info,
-                                "received_value": val,
-                            },
-                        }
-                        errors.append(error)
-                        continue
-            else:
-                if isinstance(type_input, list):
-                    if val not in type_input:
-                        input_config = info
-                        list_info = ""
-
-                        # 不要像它们是大量扫描的模型文件路径那样发送回巨大的列表
-                        if len(type_input) > 20:
-                            list_info = f"(长度为 {len(type_input)} 的列表)"
-                            input_config = None
-                        else:
-                            list_info = str(type_input)
-
-                        error = {
-                            "type": "value_not_in_list",
-                            "message": "值不在列表中",
-                            "details": f"{x}：'{val}' 不在 {list_info} 中",
-                            "extra_info": {
-                                "input_name": x,
-                                "input_config": input_config,
-                                "received_value": val,
-                            },
-                        }
-                        errors.append(error)
-                        continue
+    # 第二阶段：所有输入都通过检查且上游节点有效时，对整个节点调用一次自定义验证方法，
+    # 结果随节点一起记录在 validated 中。只传入转换后的字面量输入（以及隐藏输入），链接的输入在验证时还没有值
+    if has_custom_validation and len(errors) == 0 and valid is True:
+        literal_inputs = {x: v for x, v in inputs.items() if not isinstance(v, list)}
+        input_data_all = get_input_data(literal_inputs, obj_class, unique_id, {}, runner)
+        ret = map_node_over_list(obj_class, input_data_all, "VALIDATE_INPUTS")
+        for r in ret:
+            if r is not True:
+                details = ""
+                if r is not False:
+                    details = str(r)
+                error = {
+                    "type": "custom_validation_failed",
+                    "message": "节点的自定义验证失败",
+                    "details": details,
+                    "extra_info": {
+                        "received_inputs": literal_inputs,
+                    },
+                }
+                errors.append(error)
 
     if len(errors) > 0 or valid is not True:
         ret = (False, errors, unique_id)
@@ -347,8 +568,8 @@ def get_input_data(
         None
 
     """
-    # 获取节点的有效输入参数类型
-    valid_inputs = class_def.INPUT_TYPES()
+    # 获取节点预编译的输入参数描述
+    schema = node_schema.get_schema(class_def)
     # 初始化节点的输入参数字典
     input_data_all = {}
     # 遍历节点的所有输入参数
@@ -362,19 +583,23 @@ def get_input_data(
             if input_unique_id not in outputs:
                 return None
             # 获取该节点的输出对象，并将其加入节点的输入参数字典中
-            obj = outputs[input_unique_id][output_index]
-            input_data_all[x] = obj
+            obj = outputs[input_unique_id]
+            if isinstance(obj, NodeOutputStream):
+                # 声明了 INPUT_IS_STREAM 的节点逐个接收上游产生的元素，其他节点等待流结束
+                if hasattr(class_def, "INPUT_IS_STREAM") and class_def.INPUT_IS_STREAM == True:
+                    input_data_all[x] = obj.iter_output(output_index)
+                    continue
+                obj = obj.materialize()[0]
+            input_data_all[x] = obj[output_index]
         else:
             # 如果输入参数不是一个列表，则表示该参数是直接指定的
             # 如果该参数是必需的或可选的，则将其加入节点的输入参数字典中
-            if ("required" in valid_inputs and x in valid_inputs["required"]) or (
-                "optional" in valid_inputs and x in valid_inputs["optional"]
-            ):
+            if x in schema.inputs:
                 input_data_all[x] = [input_data]
 
     # 处理节点的隐藏输入参数
-    if "hidden" in valid_inputs:
-        h = valid_inputs["hidden"]
+    if schema.has_hidden:
+        h = schema.hidden
         for x in h:
             if h[x] == "PROMPT":
                 input_data_all[x] = [runners]
@@ -386,26 +611,31 @@ def get_input_data(
     return input_data_all
 
 
-def get_output_data(obj: nodes.BaseNode, input_data_all):
+def is_stream(value):
     """
-    获取节点执行结果。
+    判断节点的返回值是否是生成器或迭代器，元组和字典这类普通返回值不是。
+    """
+    return inspect.isgenerator(value) or isinstance(value, collections.abc.Iterator)
+
+
+def merge_ui(uis):
+    # 合并 UI 数据
+    return {k: [y for x in uis for y in x[k]] for k in uis[0].keys()}
+
+
+def merge_output_data(obj: nodes.BaseNode, return_values):
+    """
+    把节点每次调用的返回值合并成节点执行结果。
 
     Args:
         obj (Node): 节点对象。
-        input_data_all (dict): 节点输入数据字典。
+        return_values (list): 每次调用 FUNCTION 的返回值列表。
 
     Returns:
         tuple: 包含节点执行结果和 UI 数据的元组。
-
-    Raises:
-        None
-
     """
     results = []
     uis = []
-    # 调用 map_node_over_list 函数执行节点的 FUNCTION 方法，并将结果存储在 return_values 列表中
-    return_values = map_node_over_list(obj, input_data_all, obj.FUNCTION)
-
     # 遍历 return_values 列表，将其中的结果分别存储在 results 和 uis 列表中
     for r in return_values:
         if isinstance(r, dict):
@@ -432,251 +662,1258 @@ def get_output_data(obj: nodes.BaseNode, input_data_all):
 
     ui = dict()
     if len(uis) > 0:
-        # 合并 UI 数据
-        ui = {k: [y for x in uis for y in x[k]] for k in uis[0].keys()}
+        ui = merge_ui(uis)
     return output, ui
 
 
-def format_value(x):
-    if x is None:
-        return None
-    elif isinstance(x, (int, float, bool, str)):
-        return x
-    else:
-        return str(x)
-
-
-def recursive_execute(
-    server,
-    runners,
-    outputs,
-    current_item,
-    extra_data,
-    executed,
-    runner_id,
-    outputs_ui,
-    object_storage,
-):
+def get_output_data(obj: nodes.BaseNode, input_data_all):
     """
-    递归执行节点。
+    获取节点执行结果。
 
     Args:
-        server (Server): 服务器对象。
-        runners (dict): 节点运行器字典。
-        outputs (dict): 节点输出数据字典。
-        current_item (str): 当前节点 ID。
-        extra_data (dict): 额外数据字典。
-        executed (set): 已执行节点 ID 集合。
-        runner_id (str): 运行器 ID。
-        outputs_ui (dict): 节点 UI 数据字典。
-        object_storage (dict): 对象存储字典。
+        obj (Node): 节点对象。
+        input_data_all (dict): 节点输入数据字典。
 
     Returns:
-        tuple: 包含执行结果、错误详情和异常对象的元组。
+        tuple: 包含节点执行结果和 UI 数据的元组。FUNCTION 返回生成器时，执行结果是一个
+            NodeOutputStream，UI 数据为空，由下游节点在迭代时逐步产生。
 
     Raises:
         None
 
     """
-    unique_id = current_item
-    inputs = runners[unique_id]["inputs"]
-    class_type = runners[unique_id]["class_type"]
-    class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
-    if unique_id in outputs:
-        return (True, None, None)
-
-    for x in inputs:
-        input_data = inputs[x]
-
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                result = recursive_execute(
-                    server,
-                    runners,
-                    outputs,
-                    input_unique_id,
-                    extra_data,
-                    executed,
-                    runner_id,
-                    outputs_ui,
-                    object_storage,
-                )
-                if result[0] is not True:
-                    # Another node failed further upstream
-                    return result
-
+    # 调用 map_node_over_list 函数执行节点的 FUNCTION 方法，并将结果存储在 return_values 列表中
+    return_values = map_node_over_list(obj, input_data_all, obj.FUNCTION)
 
-    input_data_all = None
-    try:
-        input_data_all = get_input_data(
-            inputs, class_def, unique_id, outputs, runners, extra_data
+    # 以生成器形式返回的结果不在这里展开，普通返回值当作只有一个元素的流
+    if any(is_stream(r) for r in return_values):
+        iterator = itertools.chain.from_iterable(
+            r if is_stream(r) else [r] for r in return_values
         )
-        if server.client_id is not None:
-            server.last_node_id = unique_id
-            server.send_sync(
-                "executing",
-                {"node": unique_id, "runner_id": runner_id},
-                server.client_id,
-            )
+        return NodeOutputStream(obj, iterator), {}
 
-        obj = object_storage.get((unique_id, class_type), None)
-        if obj is None:
-            obj = class_def()
-            object_storage[(unique_id, class_type)] = obj
+    return merge_output_data(obj, return_values)
 
-        output_data, output_ui = get_output_data(obj, input_data_all)
-        outputs[unique_id] = output_data
-        if len(output_ui) > 0:
-            outputs_ui[unique_id] = output_ui
-            if server.client_id is not None:
-                server.send_sync(
-                    "executed",
-                    {"node": unique_id, "output": output_ui, "runner_id": runner_id},
-                    server.client_id,
-                )
 
-    except Exception as ex:
-        typ, _, tb = sys.exc_info()
-        exception_type = full_type_name(typ)
-        input_data_formatted = {}
-        if input_data_all is not None:
-            input_data_formatted = {}
-            for name, inputs in input_data_all.items():
-                input_data_formatted[name] = [format_value(x) for x in inputs]
-
-        output_data_formatted = {}
-        for node_id, node_outputs in outputs.items():
-            output_data_formatted[node_id] = [
-                [format_value(x) for x in l] for l in node_outputs
-            ]
+class NodeOutputStream:
+    """
+    FUNCTION 返回生成器的节点的输出。
 
-        print("!!! Exception during processing !!!")
-        print(traceback.format_exc())
+    生成器产生的每个元素都和普通 FUNCTION 的返回值格式相同（结果元组，或包含 "ui"/"result" 的字典）。
+    已经产生的元素会被保存，多个下游节点可以各自从头迭代。声明了 INPUT_IS_STREAM 的下游节点在元素产生时
+    就能逐个处理；其他下游节点读取时会把整个流展开成普通的执行结果。
+    """
 
-        error_details = {
-            "node_id": unique_id,
-            "exception_message": str(ex),
-            "exception_type": exception_type,
-            "traceback": traceback.format_tb(tb),
-            "current_inputs": input_data_formatted,
-            "current_outputs": output_data_formatted,
-        }
-        return (False, error_details, ex)
+    def __init__(self, obj, iterator):
+        self.mutex = threading.RLock()
+        self.obj = obj
+        self.iterator = iterator
+        self.return_values = []
+        self.uis = []
+        self.done = False
+        self.error = None
+        self.materialized = None
+        # 每产生一份 UI 数据时以累计的 UI 数据调用
+        self.on_ui = None
+        # 生成器结束（或出错）后调用一次
+        self.on_done = None
+
+    def get_result(self, i):
+        """
+        获取第 i 个结果，必要时从生成器中继续取值。流结束时返回 (False, None)。
+        """
+        with self.mutex:
+            while i >= len(self.return_values) and not self.done:
+                if self.error is not None:
+                    raise self.error
+                try:
+                    r = next(self.iterator)
+                except StopIteration:
+                    self.done = True
+                    self.finish()
+                    break
+                except Exception as ex:
+                    self.error = ex
+                    self.finish()
+                    raise
+                self.return_values.append(r)
+                if isinstance(r, dict) and "ui" in r:
+                    self.uis.append(r["ui"])
+                    if self.on_ui is not None:
+                        self.on_ui(merge_ui(self.uis))
+
+            if i >= len(self.return_values):
+                return (False, None)
+            r = self.return_values[i]
+        if isinstance(r, dict):
+            return (True, r.get("result", None))
+        return (True, r)
+
+    def finish(self):
+        if self.on_done is not None:
+            on_done = self.on_done
+            self.on_done = None
+            on_done()
+
+    def close(self):
+        """
+        不再读取剩余的元素，关闭生成器并结束流。已经结束的流不受影响。
+        """
+        with self.mutex:
+            if self.done:
+                return
+            self.done = True
+            try:
+                if hasattr(self.iterator, "close"):
+                    self.iterator.close()
+            except Exception as ex:
+                print("Failed to close streamed output:", ex)
+            self.finish()
+
+    def iter_output(self, index):
+        """
+        逐个产生第 index 个输出的元素，供声明了 INPUT_IS_STREAM 的下游节点使用。
+        """
+        is_list = False
+        if hasattr(self.obj, "OUTPUT_IS_LIST"):
+            is_list = self.obj.OUTPUT_IS_LIST[index]
+        i = 0
+        while True:
+            has_result, result = self.get_result(i)
+            if not has_result:
+                return
+            i += 1
+            if result is None:
+                continue
+            if is_list:
+                yield from result[index]
+            else:
+                yield result[index]
+
+    def materialize(self):
+        """
+        耗尽生成器，返回与 get_output_data 相同格式的执行结果和 UI 数据。
+        """
+        with self.mutex:
+            if self.materialized is None:
+                i = 0
+                while True:
+                    # 在节点的执行时限内读取时，超时或中断后不再从生成器取值
+                    internal.utils.throw_if_interrupted()
+                    if not self.get_result(i)[0]:
+                        break
+                    i += 1
+                self.materialized = merge_output_data(self.obj, self.return_values)
+            return self.materialized
 
-    executed.add(unique_id)
 
-    return (True, None, None)
+def has_stream_consumer(runners, unique_id):
+    """
+    判断是否有声明了 INPUT_IS_STREAM 的下游节点直接读取这个节点的输出。
+    只在节点返回了流时调用。
+    """
+    for node in runners.values():
+        class_def = nodes.NODE_CLASS_MAPPINGS.get(node["class_type"], None)
+        if not (hasattr(class_def, "INPUT_IS_STREAM") and class_def.INPUT_IS_STREAM == True):
+            continue
+        for input_data in node["inputs"].values():
+            if isinstance(input_data, list) and len(input_data) == 2 and input_data[0] == unique_id:
+                return True
+    return False
 
 
-def recursive_output_delete_if_changed(runners, old_runners, outputs, current_item):
+def materialize_streams(outputs, outputs_ui, drain=True):
     """
-    递归删除已更改的输出节点。
+    把执行结束后仍是流的节点输出展开成普通的执行结果，展开失败的输出会被删除。
 
     Args:
-        runners (dict): 节点图的节点字典。
-        old_runners (dict): 节点图的旧节点字典。
-        outputs (dict): 节点图的输出节点字典。
-        current_item (str): 当前节点 ID。
-
-    Returns:
-        bool: 是否需要删除当前节点。
-
-    Raises:
-        None
-
+        outputs (dict): 节点输出数据字典。
+        outputs_ui (dict): 节点 UI 数据字典。
+        drain (bool, optional): 是否读完未结束的流。执行失败（出错、中断或超时）时为 False，
+            未结束的流会被关闭并删除，不再运行上游生成器。默认为 True。
     """
-    unique_id = current_item
-    inputs = runners[unique_id]["inputs"]
-    class_type = runners[unique_id]["class_type"]
-    class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
+    for unique_id in list(outputs.keys()):
+        stream = outputs[unique_id]
+        if not isinstance(stream, NodeOutputStream):
+            continue
+        if not drain and not stream.done:
+            stream.close()
+            outputs.pop(unique_id)
+            continue
+        try:
+            output_data, output_ui = stream.materialize()
+        except Exception as ex:
+            print(f"Failed to read streamed output of node {unique_id}:", ex)
+            outputs.pop(unique_id)
+            continue
+        outputs[unique_id] = output_data
+        if len(output_ui) > 0:
+            outputs_ui[unique_id] = output_ui
 
-    is_changed_old = ""
-    is_changed = ""
-    to_delete = False
-    if hasattr(class_def, "IS_CHANGED"):
-        if unique_id in old_runners and "is_changed" in old_runners[unique_id]:
-            is_changed_old = old_runners[unique_id]["is_changed"]
-        if "is_changed" not in runners[unique_id]:
-            input_data_all = get_input_data(inputs, class_def, unique_id, outputs)
-            if input_data_all is not None:
-                try:
-                    # is_changed = class_def.IS_CHANGED(**input_data_all)
-                    is_changed = map_node_over_list(
-                        class_def, input_data_all, "IS_CHANGED"
-                    )
-                    runners[unique_id]["is_changed"] = is_changed
-                except:
-                    to_delete = True
-        else:
-            is_changed = runners[unique_id]["is_changed"]
 
-    if unique_id not in outputs:
-        return True
+# 进程池中每个子进程自己的节点实例池
+process_instance_pool = execution_cache.NodeInstancePool()
 
-    if not to_delete:
-        if is_changed != is_changed_old:
-            to_delete = True
-        elif unique_id not in old_runners:
-            to_delete = True
-        elif inputs == old_runners[unique_id]["inputs"]:
-            for x in inputs:
-                input_data = inputs[x]
-
-                if isinstance(input_data, list):
-                    input_unique_id = input_data[0]
-                    output_index = input_data[1]
-                    if input_unique_id in outputs:
-                        to_delete = recursive_output_delete_if_changed(
-                            runners, old_runners, outputs, input_unique_id
-                        )
-                    else:
-                        to_delete = True
-                    if to_delete:
-                        break
-        else:
-            to_delete = True
 
-    if to_delete:
-        d = outputs.pop(unique_id)
-        del d
-    return to_delete
+def init_process_worker():
+    """
+    进程池子进程的初始化函数，加载自定义节点，使 NODE_CLASS_MAPPINGS 与主进程一致。
+    """
+    nodes.init_custom_nodes()
+    node_schema.build_registry()
 
 
-def recursive_will_execute(runners, outputs, current_item):
+def get_output_data_in_process(class_type, input_data_all):
     """
-    递归查找将要执行的节点。
+    在进程池的子进程中执行节点，参数和返回值都会经过 pickle。
 
     Args:
-        runners (dict): 节点图的节点字典。
-        outputs (dict): 节点图的输出节点字典。
-        current_item (str): 当前节点 ID。
+        class_type (str): 节点类型。
+        input_data_all (dict): 节点输入数据字典。
 
     Returns:
-        list: 将要执行的节点 ID 列表。
+        tuple: 包含节点执行结果和 UI 数据的元组。
+    """
+    obj = process_instance_pool.acquire(class_type)
+    try:
+        return get_output_data(obj, input_data_all)
+    finally:
+        process_instance_pool.release(class_type, obj)
 
-    Raises:
+
+# 错误详情中每个值的最大长度，超过时截断，None 表示不截断
+ERROR_VALUE_MAX_LENGTH = 1024
+
+
+def set_error_value_max_length(max_length):
+    global ERROR_VALUE_MAX_LENGTH
+    ERROR_VALUE_MAX_LENGTH = max_length
+
+
+def format_value(x, max_length=None):
+    if x is None:
+        return None
+    elif isinstance(x, (int, float, bool)):
+        return x
+    elif isinstance(x, str):
+        if max_length is not None and len(x) > max_length:
+            return x[:max_length] + f"...({len(x)} chars)"
+        return x
+    elif max_length is not None:
+        # 限制容器元素数量和字符串长度，避免先完整转换巨大的对象
+        r = reprlib.Repr()
+        r.maxstring = max_length
+        r.maxother = max_length
+        return r.repr(x)[:max_length]
+    else:
+        return str(x)
+
+
+def format_error_values(input_data_all, outputs, node_ids, max_length=None):
+    """
+    将出错节点的输入参数和指定节点的输出整理成可以发送给客户端的格式。
+
+    Args:
+        input_data_all (dict): 出错节点的输入参数字典，可能为 None。
+        outputs (dict): 节点输出数据字典。
+        node_ids (Iterable): 需要包含输出的节点 ID。
+        max_length (int, optional): 每个值的最大长度，为 None 时不截断。
+
+    Returns:
+        tuple: 格式化后的输入参数字典和输出字典。
+    """
+    input_data_formatted = {}
+    if input_data_all is not None:
+        for name, inputs in input_data_all.items():
+            # 流式输入是上游生成器的迭代器，迭代它会在错误处理中继续执行上游节点，只显示占位符
+            if not isinstance(inputs, (list, tuple)):
+                input_data_formatted[name] = ["<stream>"]
+                continue
+            input_data_formatted[name] = [format_value(x, max_length) for x in inputs]
+
+    output_data_formatted = {}
+    for node_id in node_ids:
+        if node_id not in outputs or isinstance(outputs[node_id], NodeOutputStream):
+            continue
+        output_data_formatted[node_id] = [
+            [format_value(x, max_length) for x in l] for l in outputs[node_id]
+        ]
+    return input_data_formatted, output_data_formatted
+
+
+def format_error_snapshot(snapshot):
+    """
+    按需格式化出错时保存的快照，包含出错节点及其直接上游节点的输出、完整的异常信息和调用栈，都不截断。
+
+    Args:
+        snapshot (dict): format_execution_error 返回的错误详情中的 "snapshot"。
+
+    Returns:
+        dict: 出错节点 ID、异常信息、调用栈、输入参数和上游节点的输出。
+    """
+    input_data_formatted, output_data_formatted = format_error_values(
+        snapshot["inputs"], snapshot["outputs"], snapshot["outputs"].keys()
+    )
+    return {
+        "node_id": snapshot["node_id"],
+        "exception_message": snapshot.get("exception_message", None),
+        "traceback": snapshot.get("traceback", None),
+        "current_inputs": input_data_formatted,
+        "current_outputs": output_data_formatted,
+    }
+
+
+class ExecutionPlan:
+    """
+    节点图的执行计划。
+
+    对每个 runner 只构建一次：根据 `[node_id, slot]` 形式的链接整理出每个节点的上游和下游，
+    再用 Kahn 算法得到整张图的拓扑序。之后的调度都基于这个计划迭代完成，不再递归遍历节点图，
+    因此很深的节点链也不会触发递归深度限制。
+
+    Attributes:
+        runners (dict): 节点图的节点字典。
+        dependencies (dict): 节点 ID -> 上游节点 ID 列表。
+        dependents (dict): 节点 ID -> 下游节点 ID 列表。
+        order (list): 拓扑序，处于循环依赖中的节点不会出现在这里。
+        position (dict): 节点 ID -> 在拓扑序中的位置。
+    """
+
+    def __init__(self, runners):
+        self.runners = runners
+        self.dependencies = {}
+        self.dependents = {}
+        for unique_id in runners:
+            self.dependencies[unique_id] = []
+            self.dependents[unique_id] = []
+
+        for unique_id in runners:
+            seen = set()
+            for input_data in runners[unique_id]["inputs"].values():
+                if not isinstance(input_data, list) or len(input_data) != 2:
+                    continue
+                input_unique_id = input_data[0]
+                # 链接到不存在的节点时不记录依赖，由 get_input_data 在执行时报错
+                if input_unique_id not in runners or input_unique_id in seen:
+                    continue
+                seen.add(input_unique_id)
+                self.dependencies[unique_id].append(input_unique_id)
+                self.dependents[input_unique_id].append(unique_id)
+
+        # Kahn 算法：不断取出入度为 0 的节点
+        in_degree = {x: len(self.dependencies[x]) for x in runners}
+        ready = collections.deque(x for x in runners if in_degree[x] == 0)
+        self.order = []
+        while len(ready) > 0:
+            unique_id = ready.popleft()
+            self.order.append(unique_id)
+            for d in self.dependents[unique_id]:
+                in_degree[d] -= 1
+                if in_degree[d] == 0:
+                    ready.append(d)
+        self.position = {x: i for i, x in enumerate(self.order)}
+
+    def cycle_nodes(self):
+        """
+        查找处于循环依赖中的节点。
+
+        不在拓扑序中的节点要么处于循环中，要么依赖循环中的节点。从这些节点中不断去掉
+        没有下游节点（在剩余节点中）的节点，剩下的就是循环中的节点以及两个循环之间的节点。
+
+        Returns:
+            set: 处于循环依赖中的节点 ID 集合。
+        """
+        remaining = {x for x in self.runners if x not in self.position}
+        out_degree = {
+            x: sum(1 for d in self.dependents[x] if d in remaining) for x in remaining
+        }
+        ready = [x for x in remaining if out_degree[x] == 0]
+        while len(ready) > 0:
+            unique_id = ready.pop()
+            remaining.discard(unique_id)
+            for input_unique_id in self.dependencies[unique_id]:
+                if input_unique_id in remaining:
+                    out_degree[input_unique_id] -= 1
+                    if out_degree[input_unique_id] == 0:
+                        ready.append(input_unique_id)
+        return remaining
+
+    def will_execute(self, outputs, current_item):
+        """
+        查找执行某个节点前需要执行的所有节点。
+
+        Args:
+            outputs (dict): 节点输出数据字典，已有输出的节点不会再执行。
+            current_item (str): 当前节点 ID。
+
+        Returns:
+            list: 按拓扑序排列的将要执行的节点 ID 列表，最后一个是 current_item。
+        """
+        if current_item in outputs:
+            return []
+
+        pending = {current_item}
+        stack = [current_item]
+        while len(stack) > 0:
+            unique_id = stack.pop()
+            for input_unique_id in self.dependencies[unique_id]:
+                if input_unique_id not in outputs and input_unique_id not in pending:
+                    pending.add(input_unique_id)
+                    stack.append(input_unique_id)
+
+        # 处于循环依赖中的节点没有拓扑位置，排在最后，由执行阶段报错
+        last = len(self.order)
+        return sorted(pending, key=lambda x: self.position.get(x, last))
+
+
+class OutputScheduler:
+    """
+    按“未执行的依赖最少优先”的顺序给出要执行的输出节点。
+
+    每个输出节点的待执行节点只在开始时计算一次，之后在节点执行完毕时增量更新剩余依赖数，
+    并用堆选出剩余依赖数最少的输出节点，不需要每轮都重新排序和遍历节点图。
+    """
+
+    def __init__(self, plan, outputs, execute_outputs):
+        self.pending = {}  # 输出节点 ID -> 开始时的待执行节点列表
+        self.remaining = {}  # 输出节点 ID -> 剩余的待执行节点数量
+        self.waiting = {}  # 节点 ID -> 等待该节点执行的输出节点 ID 列表
+        self.heap = []
+        for output_node_id in execute_outputs:
+            if output_node_id in self.pending:
+                continue
+            pending = plan.will_execute(outputs, output_node_id)
+            self.pending[output_node_id] = pending
+            self.remaining[output_node_id] = len(pending)
+            for unique_id in pending:
+                self.waiting.setdefault(unique_id, []).append(output_node_id)
+            heapq.heappush(self.heap, (len(pending), output_node_id))
+
+    def pop(self):
+        """
+        取出剩余依赖最少的输出节点，没有待执行的输出节点时返回 None。
+        """
+        while len(self.heap) > 0:
+            count, output_node_id = heapq.heappop(self.heap)
+            # 跳过剩余依赖数已经变化的过期条目
+            if self.remaining.get(output_node_id, None) == count:
+                del self.remaining[output_node_id]
+                return output_node_id
+        return None
+
+    def output_executed(self, output_node_id):
+        """
+        输出节点及其上游节点执行成功后调用，更新其他输出节点的剩余依赖数。
+        """
+        changed = set()
+        for unique_id in self.pending.pop(output_node_id, []):
+            for o in self.waiting.pop(unique_id, []):
+                if o in self.remaining:
+                    self.remaining[o] -= 1
+                    changed.add(o)
+        # 每个输出节点只放入一次新的条目
+        for o in changed:
+            heapq.heappush(self.heap, (self.remaining[o], o))
+
+
+def has_side_effects(class_def):
+    """
+    判断节点类是否有副作用：输出节点和声明了 SIDE_EFFECTS 的节点每次都必须真正执行。
+    """
+    if hasattr(class_def, "OUTPUT_NODE") and class_def.OUTPUT_NODE == True:
+        return True
+    return hasattr(class_def, "SIDE_EFFECTS") and class_def.SIDE_EFFECTS == True
+
+
+def eliminate_common_subexpressions(plan):
+    """
+    找出节点图中 class_type、字面量输入和上游来源都相同的节点，只保留拓扑序中的第一个。
+
+    下游节点的输入会改为指向保留的节点，重复的节点不再被任何节点引用，因此不会执行；
+    返回的别名表用于在执行后把结果复制给这些节点。声明了 IS_CHANGED、有副作用或使用隐藏输入的节点不参与合并。
+    修改了节点图后需要重新构建执行计划。
+
+    Args:
+        plan (ExecutionPlan): 节点图的执行计划。
+
+    Returns:
+        dict: 被合并的节点 ID -> 保留的节点 ID。
+    """
+    runners = plan.runners
+    aliases = {}
+    representatives = {}  # 节点签名 -> 保留的节点 ID
+    for unique_id in plan.order:
+        node = runners[unique_id]
+        inputs = node["inputs"]
+
+        # 先把输入中指向已合并节点的连接改为指向保留的节点
+        if any(isinstance(v, list) and v[0] in aliases for v in inputs.values()):
+            inputs = {
+                x: [aliases[v[0]], v[1]] if isinstance(v, list) and v[0] in aliases else v
+                for x, v in inputs.items()
+            }
+            node["inputs"] = inputs
+
+        class_def = nodes.NODE_CLASS_MAPPINGS[node["class_type"]]
+        if (
+            hasattr(class_def, "IS_CHANGED")
+            or has_side_effects(class_def)
+            or node_schema.get_schema(class_def).has_hidden
+        ):
+            continue
+
+        literals = {}
+        links = []
+        for x in sorted(inputs):
+            if isinstance(inputs[x], list):
+                links.append([x, inputs[x][0], inputs[x][1]])
+            else:
+                literals[x] = inputs[x]
+        signature = hash_value([node["class_type"], literals, links])
+        if signature in representatives:
+            aliases[unique_id] = representatives[signature]
+        else:
+            representatives[signature] = unique_id
+    return aliases
+
+
+def hash_value(value):
+    """
+    把可以序列化为 JSON 的值规范化（字典按键排序）后计算 sha256，无法序列化的部分按 str() 处理。
+
+    Args:
+        value (Any): 要计算哈希的值。
+
+    Returns:
+        str: 十六进制的哈希值。
+    """
+    payload = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fingerprint_node(node):
+    """
+    计算节点的结构指纹，包含 class_type、输入参数和 IS_CHANGED 的值。
+
+    执行后只保存指纹而不是节点的深拷贝，下次提交时比较指纹即可判断节点是否更改。
+
+    Args:
+        node (dict): 节点图中的一个节点。
+
+    Returns:
+        str: 节点指纹。
+    """
+    return hash_value(
+        [node["class_type"], node["inputs"], node.get("is_changed", "")]
+    )
+
+
+def compute_cache_key(runners, outputs, current_item):
+    """
+    计算单个节点的缓存键，调用前其上游节点的缓存键必须已经计算完毕。
+
+    缓存键由 class_type、节点代码的标识、字面量输入、上游节点的缓存键和输出槽位以及 IS_CHANGED 的值计算得到，
+    节点代码更改后该节点及其下游节点的键都会改变。缓存键与节点 ID 无关，因此不同客户端提交的相同子图、或重新编号后的节点都能得到相同的键。
+
+    Args:
+        runners (dict): 节点图的节点字典。
+        outputs (dict): 节点输出数据字典，用于计算 IS_CHANGED。
+        current_item (str): 当前节点 ID。
+
+    Returns:
+        str: 缓存键，无法缓存时返回 None。
+    """
+    unique_id = current_item
+    node = runners[unique_id]
+    class_def = nodes.NODE_CLASS_MAPPINGS[node["class_type"]]
+
+    literals = {}
+    links = []
+    for x in sorted(node["inputs"]):
+        input_data = node["inputs"][x]
+        if isinstance(input_data, list):
+            if input_data[0] not in runners:
+                return None
+            input_cache_key = runners[input_data[0]].get("cache_key", None)
+            if input_cache_key is None:
+                return None
+            links.append([x, input_cache_key, input_data[1]])
+        else:
+            literals[x] = input_data
+
+    try:
+        is_changed = get_is_changed(runners, outputs, unique_id)
+    except:
+        return None
+    if is_changed is None:
+        return None
+
+    # 使用隐藏输入的节点可能依赖自身 ID，此时把 ID 也计入缓存键
+    schema = node_schema.get_schema(class_def)
+    hidden_id = None
+    if schema.has_hidden:
+        hidden_id = unique_id
+
+    return hash_value(
+        [node["class_type"], schema.code_version, literals, links, is_changed, hidden_id]
+    )
+
+
+def get_cache_key(runners, outputs, current_item):
+    """
+    获取节点的缓存键，按需迭代计算其上游节点的缓存键，结果记录在 runners[x]["cache_key"] 中。
+
+    Args:
+        runners (dict): 节点图的节点字典。
+        outputs (dict): 节点输出数据字典。
+        current_item (str): 当前节点 ID。
+
+    Returns:
+        str: 缓存键，无法缓存时返回 None。
+    """
+    visiting = set()
+    stack = [(current_item, False)]
+    while len(stack) > 0:
+        unique_id, expanded = stack.pop()
+        node = runners[unique_id]
+        if "cache_key" in node:
+            continue
+        if expanded:
+            node["cache_key"] = compute_cache_key(runners, outputs, unique_id)
+            continue
+        if unique_id in visiting:
+            # 循环依赖的节点无法缓存
+            node["cache_key"] = None
+            continue
+        visiting.add(unique_id)
+        stack.append((unique_id, True))
+        for input_data in node["inputs"].values():
+            if isinstance(input_data, list) and input_data[0] in runners:
+                if "cache_key" not in runners[input_data[0]]:
+                    stack.append((input_data[0], False))
+    return runners[current_item]["cache_key"]
+
+
+def format_execution_error(runners, unique_id, ex, input_data_all, outputs):
+    """
+    将节点执行时的异常整理成发送给客户端的错误详情。
+
+    错误详情中只包含出错节点及其直接上游节点的输出，每个值、异常信息和调用栈都会被截断到 ERROR_VALUE_MAX_LENGTH。
+    这些节点的输出、完整的异常信息和调用栈保存在 "snapshot" 中，需要时再用 format_error_snapshot 格式化。
+
+    Args:
+        runners (dict): 节点图的节点字典。
+        unique_id (str): 出错节点 ID。
+        ex (Exception): 异常对象。
+        input_data_all (dict): 出错节点的输入参数字典，可能为 None。
+        outputs (dict): 节点输出数据字典。
+
+    Returns:
+        dict: 错误详情。
+    """
+    tb = ex.__traceback__
+    exception_type = full_type_name(type(ex))
+
+    node_ids = [unique_id]
+    for input_data in runners[unique_id]["inputs"].values():
+        if isinstance(input_data, list) and input_data[0] not in node_ids:
+            node_ids.append(input_data[0])
+    input_data_formatted, output_data_formatted = format_error_values(
+        input_data_all, outputs, node_ids, ERROR_VALUE_MAX_LENGTH
+    )
+
+    print("!!! Exception during processing !!!")
+    print("".join(traceback.format_exception(type(ex), ex, tb)))
+
+    exception_message = str(ex)
+    traceback_lines = traceback.format_tb(tb)
+    return {
+        "node_id": unique_id,
+        "exception_message": format_value(exception_message, ERROR_VALUE_MAX_LENGTH),
+        "exception_type": exception_type,
+        "traceback": truncate_traceback(traceback_lines, ERROR_VALUE_MAX_LENGTH),
+        "current_inputs": input_data_formatted,
+        "current_outputs": output_data_formatted,
+        # 只引用出错节点及其直接上游节点的输出，队列中保存的快照不会让其他节点的大输出一直留在内存中
+        "snapshot": {
+            "node_id": unique_id,
+            "exception_message": exception_message,
+            "traceback": traceback_lines,
+            "inputs": input_data_all,
+            "outputs": {x: outputs[x] for x in node_ids if x in outputs},
+        },
+    }
+
+
+def truncate_traceback(traceback_lines, max_length=None):
+    """
+    从最内层的调用开始保留调用栈，总长度超过 max_length 时丢弃外层的调用，每一层也截断到 max_length。
+    """
+    if max_length is None:
+        return traceback_lines
+    lines = []
+    length = 0
+    for line in reversed(traceback_lines):
+        line = format_value(line, max_length)
+        if len(lines) > 0 and length + len(line) > max_length:
+            lines.append(f"...({len(traceback_lines) - len(lines)} more frames)")
+            break
+        lines.append(line)
+        length += len(line)
+    return list(reversed(lines))
+
+
+def execute_node(
+    server,
+    runners,
+    outputs,
+    current_item,
+    extra_data,
+    executed,
+    runner_id,
+    outputs_ui,
+    instance_pool,
+    process_pool=None,
+    output_cache=None,
+    cancellation_token=None,
+    profile=None,
+):
+    """
+    执行单个节点，调用前其上游节点必须已经执行完毕。
+
+    Args:
+        server (Server): 服务器对象。
+        runners (dict): 节点运行器字典。
+        outputs (dict): 节点输出数据字典。
+        current_item (str): 当前节点 ID。
+        extra_data (dict): 额外数据字典。
+        executed (set): 已执行节点 ID 集合。
+        runner_id (str): 运行器 ID。
+        outputs_ui (dict): 节点 UI 数据字典。
+        instance_pool (NodeInstancePool): 按 class_type 复用节点实例的实例池。
+        process_pool (ProcessPoolExecutor, optional): 执行 RUN_IN_PROCESS 节点的进程池，为 None 时在当前线程执行。
+        output_cache (OutputCache, optional): 跨 runner 共享的输出缓存，为 None 时不使用。
+        cancellation_token (CancellationToken, optional): runner 的取消令牌。
+        profile (RunnerProfile, optional): 记录节点耗时的 profile，为 None 时不记录。
+
+    Returns:
+        tuple: 包含执行结果、错误详情和异常对象的元组。
+
+    Raises:
         None
 
     """
     unique_id = current_item
     inputs = runners[unique_id]["inputs"]
-    will_execute = []
+    class_type = runners[unique_id]["class_type"]
+    class_def = nodes.NODE_CLASS_MAPPINGS[class_type]
     if unique_id in outputs:
-        return []
+        return (True, None, None)
 
-    for x in inputs:
-        input_data = inputs[x]
-        if isinstance(input_data, list):
-            input_unique_id = input_data[0]
-            output_index = input_data[1]
-            if input_unique_id not in outputs:
-                will_execute += recursive_will_execute(
-                    runners, outputs, input_unique_id
+    input_data_all = None
+    output_data = None
+    cached = None
+    record = None
+    if profile is not None:
+        record = profile.begin(unique_id, class_type)
+    # 事件发送给提交这个 runner 的客户端
+    client_id = extra_data.get("client_id", None)
+    internal.utils.set_executing_node(runner_id, client_id, unique_id)
+    # 节点中的 ProgressBar 和列表元素之间通过当前上下文的取消令牌检查 runner 是否被中断
+    internal.utils.set_cancellation_token(cancellation_token)
+    # 节点类可以通过 TIMEOUT 声明默认的执行时限（秒）
+    timeout = getattr(class_def, "TIMEOUT", None)
+    if timeout is not None:
+        internal.utils.set_node_deadline(time.monotonic() + timeout)
+    try:
+        if cancellation_token is not None:
+            cancellation_token.throw_if_cancelled()
+        input_data_all = get_input_data(
+            inputs, class_def, unique_id, outputs, runners, extra_data
+        )
+        if record is not None:
+            profile.inputs_ready(record)
+        # 记录本次执行时 IS_CHANGED 的值，下次提交时据此判断输出能否复用
+        try:
+            get_is_changed(runners, outputs, unique_id)
+        except:
+            pass
+        server.set_executing_node(runner_id, client_id, unique_id)
+        if client_id is not None:
+            server.send_sync(
+                "executing",
+                {"node": unique_id, "runner_id": runner_id},
+                client_id,
+            )
+
+        # 输出节点和有副作用的节点总是执行，其余节点先查找共享的输出缓存
+        cache_key = None
+        if output_cache is not None and not has_side_effects(class_def):
+            cache_key = get_cache_key(runners, outputs, unique_id)
+            if cache_key is not None:
+                cached = output_cache.get(cache_key)
+
+        if cached is not None:
+            output_data, output_ui = cached
+        elif (
+            process_pool is not None
+            and hasattr(class_def, "RUN_IN_PROCESS")
+            and class_def.RUN_IN_PROCESS == True
+        ):
+            # CPU 密集的节点放到进程池中执行，避免占用 GIL
+            output_data, output_ui = wait_for_future(
+                process_pool.submit(get_output_data_in_process, class_type, input_data_all)
+            )
+        else:
+            obj = instance_pool.acquire(class_type)
+            try:
+                output_data, output_ui = get_output_data(obj, input_data_all)
+            except (
+                internal.utils.ExecutionTimeoutException,
+                internal.utils.InterruptProcessingException,
+            ):
+                # 超时或中断的调用可能还在后台线程中使用这个实例，不再放回实例池
+                instance_pool.discard(class_type, obj)
+                raise
+            except BaseException:
+                instance_pool.release(class_type, obj)
+                raise
+            if isinstance(output_data, NodeOutputStream):
+                # 生成器还会继续使用这个实例，流结束后再放回实例池
+                output_data.on_done = functools.partial(
+                    instance_pool.release, class_type, obj
                 )
+            else:
+                instance_pool.release(class_type, obj)
+
+        if isinstance(output_data, NodeOutputStream):
+            # 流式输出每产生一份 UI 数据就发送一次累计的结果
+            def send_partial_ui(ui):
+                if client_id is not None:
+                    server.send_sync(
+                        "executed",
+                        {"node": unique_id, "output": ui, "runner_id": runner_id, "partial": True},
+                        client_id,
+                    )
+
+            output_data.on_ui = send_partial_ui
+            # 没有逐个接收元素的下游节点（包括输出节点）时，在这个节点自己的执行时限和错误处理中立即读完整个流，
+            # 生成器的耗时和异常都记在这个节点上，而不是第一个读取它的下游节点
+            if (
+                hasattr(class_def, "OUTPUT_NODE") and class_def.OUTPUT_NODE == True
+            ) or not has_stream_consumer(runners, unique_id):
+                stream = output_data
+                try:
+                    output_data, output_ui = call_with_deadline(stream.materialize)
+                except BaseException:
+                    # 超时后生成器可能还卡在后台线程中，在后台关闭流，关闭后节点实例放回实例池
+                    threading.Thread(
+                        target=stream.close, name="close_stream", daemon=True
+                    ).start()
+                    raise
+            else:
+                cache_key = None
+        if cache_key is not None and cached is None:
+            output_cache.put(cache_key, (output_data, output_ui))
+        outputs[unique_id] = output_data
+        if len(output_ui) > 0:
+            outputs_ui[unique_id] = output_ui
+            if client_id is not None:
+                server.send_sync(
+                    "executed",
+                    {"node": unique_id, "output": output_ui, "runner_id": runner_id},
+                    client_id,
+                )
+
+    except internal.utils.InterruptProcessingException as ex:
+        print(f"Processing interrupted at node {unique_id}")
+        if record is not None:
+            profile.end(record, error=True)
+        return (False, {"node_id": unique_id}, ex)
+    except Exception as ex:
+        if record is not None:
+            profile.end(record, error=True)
+        error_details = format_execution_error(
+            runners, unique_id, ex, input_data_all, outputs
+        )
+        return (False, error_details, ex)
+    finally:
+        internal.utils.set_cancellation_token(None)
+        internal.utils.set_node_deadline(None)
+        internal.utils.set_executing_node(None, None, None)
+
+    if record is not None:
+        profile.end(record, output_data, cached is not None)
+    executed.add(unique_id)
+
+    return (True, None, None)
+
+
+def execute_plan(
+    server,
+    plan,
+    outputs,
+    current_item,
+    extra_data,
+    executed,
+    runner_id,
+    outputs_ui,
+    instance_pool,
+    process_pool=None,
+    output_cache=None,
+    cancellation_token=None,
+    profile=None,
+):
+    """
+    按执行计划的拓扑序迭代执行一个节点及其所有尚未执行的上游节点。
+
+    Args:
+        server (Server): 服务器对象。
+        plan (ExecutionPlan): 节点图的执行计划。
+        outputs (dict): 节点输出数据字典。
+        current_item (str): 当前节点 ID。
+        extra_data (dict): 额外数据字典。
+        executed (set): 已执行节点 ID 集合。
+        runner_id (str): 运行器 ID。
+        outputs_ui (dict): 节点 UI 数据字典。
+        instance_pool (NodeInstancePool): 按 class_type 复用节点实例的实例池。
+        process_pool (ProcessPoolExecutor, optional): 执行 RUN_IN_PROCESS 节点的进程池，为 None 时在当前线程执行。
+        output_cache (OutputCache, optional): 跨 runner 共享的输出缓存，为 None 时不使用。
+        cancellation_token (CancellationToken, optional): runner 的取消令牌，被取消后不再执行后续节点。
+        profile (RunnerProfile, optional): 记录节点耗时的 profile，为 None 时不记录。
+
+    Returns:
+        tuple: 包含执行结果、错误详情和异常对象的元组。
+
+    Raises:
+        None
+
+    """
+    for unique_id in plan.will_execute(outputs, current_item):
+        if unique_id not in plan.position:
+            ex = RuntimeError(f"节点 {unique_id} 处于循环依赖中")
+            error_details = format_execution_error(
+                plan.runners, unique_id, ex, None, outputs
+            )
+            return (False, error_details, ex)
+
+        result = execute_node(
+            server,
+            plan.runners,
+            outputs,
+            unique_id,
+            extra_data,
+            executed,
+            runner_id,
+            outputs_ui,
+            instance_pool,
+            process_pool,
+            output_cache,
+            cancellation_token,
+            profile,
+        )
+        if result[0] is not True:
+            # 上游节点执行失败，后续节点不再执行
+            return result
+
+    return (True, None, None)
+
+
+def execute_plan_parallel(
+    server,
+    plan,
+    outputs,
+    execute_outputs,
+    extra_data,
+    executed,
+    runner_id,
+    outputs_ui,
+    instance_pool,
+    pool,
+    process_pool=None,
+    output_cache=None,
+    cancellation_token=None,
+    profile=None,
+):
+    """
+    把执行计划中已就绪的节点分发到线程池并行执行。
+
+    一个节点的所有上游节点执行完毕后才会被提交，互不依赖的分支因此可以同时运行。
+    某个节点失败后不再提交新节点，等待已提交的节点结束后返回第一个错误。
+
+    Args:
+        server (Server): 服务器对象。
+        plan (ExecutionPlan): 节点图的执行计划。
+        outputs (dict): 节点输出数据字典。
+        execute_outputs (list): 要执行的输出节点 ID 列表。
+        extra_data (dict): 额外数据字典。
+        executed (set): 已执行节点 ID 集合。
+        runner_id (str): 运行器 ID。
+        outputs_ui (dict): 节点 UI 数据字典。
+        instance_pool (NodeInstancePool): 按 class_type 复用节点实例的实例池。
+        pool (ThreadPoolExecutor): 执行节点的线程池。
+        process_pool (ProcessPoolExecutor, optional): 执行 RUN_IN_PROCESS 节点的进程池。
+        output_cache (OutputCache, optional): 跨 runner 共享的输出缓存。
+        cancellation_token (CancellationToken, optional): runner 的取消令牌，被取消后不再提交新节点。
+        profile (RunnerProfile, optional): 记录节点耗时的 profile，为 None 时不记录。
+
+    Returns:
+        tuple: 包含执行结果、错误详情和异常对象的元组。
+
+    Raises:
+        None
 
-    return will_execute + [unique_id]
+    """
+    pending = set()
+    for output_node_id in execute_outputs:
+        pending.update(plan.will_execute(outputs, output_node_id))
+
+    for unique_id in pending:
+        if unique_id not in plan.position:
+            ex = RuntimeError(f"节点 {unique_id} 处于循环依赖中")
+            error_details = format_execution_error(
+                plan.runners, unique_id, ex, None, outputs
+            )
+            return (False, error_details, ex)
+
+    # 每个待执行节点还在等待的上游节点数量
+    remaining = {}
+    for unique_id in pending:
+        remaining[unique_id] = len(
+            [x for x in plan.dependencies[unique_id] if x in pending]
+        )
+    ready = collections.deque(
+        sorted(
+            [x for x in pending if remaining[x] == 0],
+            key=plan.position.__getitem__,
+        )
+    )
+    if profile is not None:
+        for unique_id in ready:
+            profile.node_ready(unique_id)
+
+    running = {}
+    error = None
+    while len(ready) > 0 or len(running) > 0:
+        while len(ready) > 0 and error is None:
+            unique_id = ready.popleft()
+            # runner 被中断后不再提交新节点，等待已提交的节点结束
+            if cancellation_token is not None and cancellation_token.is_cancelled():
+                ex = internal.utils.InterruptProcessingException()
+                error = (False, {"node_id": unique_id}, ex)
+                break
+            future = pool.submit(
+                execute_node,
+                server,
+                plan.runners,
+                outputs,
+                unique_id,
+                extra_data,
+                executed,
+                runner_id,
+                outputs_ui,
+                instance_pool,
+                process_pool,
+                output_cache,
+                cancellation_token,
+                profile,
+            )
+            running[future] = unique_id
+        if len(running) == 0:
+            break
+
+        done, _ = concurrent.futures.wait(
+            running, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        for future in done:
+            unique_id = running.pop(future)
+            result = future.result()
+            if result[0] is not True:
+                if error is None:
+                    error = result
+                continue
+            # 释放所有输入都已就绪的下游节点
+            for d in plan.dependents[unique_id]:
+                if d in remaining:
+                    remaining[d] -= 1
+                    if remaining[d] == 0:
+                        ready.append(d)
+                        if profile is not None:
+                            profile.node_ready(d)
+
+    if error is not None:
+        return error
+    return (True, None, None)
+
+
+def get_is_changed(runners, outputs, current_item):
+    """
+    获取节点 IS_CHANGED 的值，结果记录在 runners[x]["is_changed"] 中，每个节点只计算一次。
+
+    Args:
+        runners (dict): 节点图的节点字典。
+        outputs (dict): 节点输出数据字典。
+        current_item (str): 当前节点 ID。
+
+    Returns:
+        Any: IS_CHANGED 的返回值列表；节点没有 IS_CHANGED 时返回 ""；上游输出不可用时返回 None。
+
+    Raises:
+        Exception: IS_CHANGED 执行出错时抛出。
+
+    """
+    unique_id = current_item
+    node = runners[unique_id]
+    if "is_changed" in node:
+        return node["is_changed"]
+    class_def = nodes.NODE_CLASS_MAPPINGS[node["class_type"]]
+    if not hasattr(class_def, "IS_CHANGED"):
+        return ""
+    input_data_all = get_input_data(node["inputs"], class_def, unique_id, outputs)
+    if input_data_all is None:
+        return None
+    node["is_changed"] = map_node_over_list(class_def, input_data_all, "IS_CHANGED")
+    return node["is_changed"]
+
+
+def invalidate_changed_outputs(plan, old_runners, outputs):
+    """
+    按拓扑序遍历一次节点图，删除已更改节点及其所有下游节点的缓存输出。
+
+    上游节点总是先于下游节点处理，失效的上游输出会被立即删除，
+    因此下游节点只需检查上游输出是否还在，就能把“脏”标记沿下游传播，不需要递归。
+
+    Args:
+        plan (ExecutionPlan): 节点图的执行计划。
+        old_runners (dict): 节点 ID -> 上次执行时的节点指纹。
+        outputs (dict): 节点输出数据字典，失效的输出会被删除。
+
+    Returns:
+        set: 可以复用输出的节点 ID 集合。
+
+    Raises:
+        None
+
+    """
+    runners = plan.runners
+    for unique_id in plan.order:
+        inputs = runners[unique_id]["inputs"]
+        to_delete = False
+        try:
+            is_changed = get_is_changed(runners, outputs, unique_id)
+        except:
+            is_changed = None
+            to_delete = True
+
+        if unique_id not in outputs:
+            continue
+
+        if not to_delete:
+            if unique_id not in old_runners or is_changed is None:
+                to_delete = True
+            elif fingerprint_node(runners[unique_id]) != old_runners[unique_id]:
+                to_delete = True
+            else:
+                for x in inputs:
+                    input_data = inputs[x]
+                    if isinstance(input_data, list) and input_data[0] not in outputs:
+                        to_delete = True
+                        break
+
+        if to_delete:
+            d = outputs.pop(unique_id)
+            del d
+
+    # 处于循环依赖中的节点不在拓扑序中，它们的输出无法复用
+    for unique_id in runners:
+        if unique_id not in plan.position and unique_id in outputs:
+            d = outputs.pop(unique_id)
+            del d
+
+    return set(outputs.keys())
+
+
+# 异步节点同时运行的调用数上限
+ASYNC_NODE_CONCURRENCY = 8
+# 执行异步节点的事件循环，在第一次使用时创建并运行在独立的守护线程中
+ASYNC_NODE_LOOP = None
+async_node_loop_lock = threading.Lock()
+
+
+def set_async_node_concurrency(concurrency):
+    global ASYNC_NODE_CONCURRENCY
+    ASYNC_NODE_CONCURRENCY = concurrency
+
+
+def wait_for_future(future):
+    """
+    等待在其他线程或进程中执行的 future。runner 被中断或超过时限时取消它，
+    并抛出 InterruptProcessingException 或 ExecutionTimeoutException。
+    """
+    token = internal.utils.get_cancellation_token()
+    if token is None and internal.utils.get_remaining_time() is None:
+        return future.result()
+    while True:
+        timeout = 0.1
+        remaining = internal.utils.get_remaining_time()
+        if remaining is not None:
+            timeout = max(0, min(timeout, remaining))
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            pass
+        try:
+            internal.utils.throw_if_interrupted()
+        except Exception:
+            future.cancel()
+            raise
+
+
+def call_with_deadline(func):
+    """
+    调用节点的同步方法。当前节点有时限时在单独的守护线程中调用，超时后不再等待它返回，
+    这样不检查取消令牌的节点（例如卡住的网络请求）也不会阻塞整个队列。
+
+    一个节点对所有列表元素的调用都放在同一个 func 中，每个节点最多启动一个线程。
+
+    Args:
+        func (Callable): 没有参数的调用。
+
+    Returns:
+        Any: 方法的返回值。
+
+    Raises:
+        ExecutionTimeoutException: 超过节点时限或 runner 的时间预算。
+    """
+    if internal.utils.get_remaining_time() is None:
+        return func()
+
+    # 新线程在调用者的上下文中运行，节点中的 ProgressBar 依然可以检查取消令牌和时限
+    context = contextvars.copy_context()
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(func))
+        except BaseException as ex:
+            future.set_exception(ex)
+
+    threading.Thread(target=run, name="node_deadline", daemon=True).start()
+    return wait_for_future(future)
+
+
+def get_async_node_loop():
+    global ASYNC_NODE_LOOP
+    with async_node_loop_lock:
+        if ASYNC_NODE_LOOP is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(
+                target=loop.run_forever, name="async_node_loop", daemon=True
+            ).start()
+            ASYNC_NODE_LOOP = loop
+        return ASYNC_NODE_LOOP
 
 
 def map_node_over_list(obj: nodes.BaseNode, input_data_all, func):
@@ -699,9 +1936,12 @@ def map_node_over_list(obj: nodes.BaseNode, input_data_all, func):
     input_is_list = False
     if hasattr(obj, "INPUT_IS_LIST"):
         input_is_list = obj.INPUT_IS_LIST
+    # 接收流的节点和 INPUT_IS_LIST 一样只调用一次，流输入是一个迭代器
+    if hasattr(obj, "INPUT_IS_STREAM") and obj.INPUT_IS_STREAM == True:
+        input_is_list = True
 
     # 计算输入参数列表的最大长度
-    if len(input_data_all) == 0:
+    if len(input_data_all) == 0 or input_is_list:
         max_len_input = 0
     else:
         max_len_input = max([len(x) for x in input_data_all.values()])
@@ -713,17 +1953,133 @@ def map_node_over_list(obj: nodes.BaseNode, input_data_all, func):
             d_new[k] = v[i if len(v) > i else -1]
         return d_new
 
-    # 初始化节点执行结果列表
-    results = []
+    # 批量节点对整列输入只调用一次
+    if (
+        hasattr(obj, "INPUT_IS_BATCH")
+        and obj.INPUT_IS_BATCH == True
+        and not input_is_list
+        and max_len_input > 0
+        and func == obj.FUNCTION
+        and numpy is not None
+    ):
+        results = map_node_over_batch(obj, input_data_all, func, max_len_input)
+        if results is not None:
+            return results
+
+    # 整理每次调用节点方法时的参数
     # 如果节点需要处理输入参数列表，则将整个列表作为参数传入节点的执行方法中
     if input_is_list:
-        results.append(getattr(obj, func)(**input_data_all))
+        calls = [input_data_all]
     # 如果输入参数列表为空，则直接调用节点的执行方法
     elif max_len_input == 0:
-        results.append(getattr(obj, func)())
+        calls = [{}]
     # 否则，对输入参数列表进行遍历，并将每个元素作为参数传入节点的执行方法中
     else:
-        for i in range(max_len_input):
-            results.append(getattr(obj, func)(**slice_dict(input_data_all, i)))
-    # 返回节点执行结果列表
-    return results
+        calls = [slice_dict(input_data_all, i) for i in range(max_len_input)]
+
+    method = getattr(obj, func)
+    # async def 定义的方法在专用事件循环上并发执行
+    if inspect.iscoroutinefunction(method):
+        future = asyncio.run_coroutine_threadsafe(
+            gather_node_calls(
+                method, calls, ASYNC_NODE_CONCURRENCY, contextvars.copy_context()
+            ),
+            get_async_node_loop(),
+        )
+        return wait_for_future(future)
+
+    # 返回节点执行结果列表，runner 被中断或超时时在列表元素之间停止
+    def call_all():
+        results = []
+        for kwargs in calls:
+            internal.utils.throw_if_interrupted()
+            results.append(method(**kwargs))
+        return results
+
+    return call_with_deadline(call_all)
+
+
+def map_node_over_batch(obj: nodes.BaseNode, input_data_all, func, max_len_input):
+    """
+    把输入参数列表对齐成整列后只调用一次批量节点的执行方法。
+
+    和逐个元素调用时一样，较短的输入会重复最后一个元素。INT/FLOAT 类型的输入会转换为 numpy 数组，
+    返回的整列输出会转换回列表并按元素拆分，因此下游节点看到的结果与逐个元素调用时相同。
+
+    Args:
+        obj (BaseNode): 节点对象。
+        input_data_all (dict): 节点的输入参数字典。
+        func (str): 节点的执行方法名称。
+        max_len_input (int): 输入参数列表的最大长度。
+
+    Returns:
+        list: 节点执行结果列表，输入无法转换为数组时返回 None。
+
+    """
+    inputs = node_schema.get_schema(type(obj)).inputs
+
+    columns = {}
+    for x, values in input_data_all.items():
+        if len(values) < max_len_input:
+            values = list(values) + [values[-1]] * (max_len_input - len(values))
+        type_input = inputs[x].type if x in inputs else None
+        if type_input in ("INT", "FLOAT"):
+            dtype = numpy.int64 if type_input == "INT" else numpy.float64
+            try:
+                values = numpy.asarray(values, dtype=dtype)
+            except (TypeError, ValueError, OverflowError):
+                return None
+        columns[x] = values
+
+    output_columns = getattr(obj, func)(**columns)
+    output_columns = [
+        c.tolist() if isinstance(c, numpy.ndarray) else list(c) for c in output_columns
+    ]
+    return list(zip(*output_columns))
+
+
+async def gather_node_calls(method, calls, concurrency, context=None):
+    """
+    并发执行节点的异步方法，同时运行的调用数不超过 concurrency。
+
+    Args:
+        method (Callable): 节点的异步方法。
+        calls (list): 每次调用的参数字典列表。
+        concurrency (int): 并发上限。
+        context (Context, optional): 调用者的上下文，其中的取消令牌、时限和节点信息会带到每个调用中，
+            runner 被取消或超过时限后取消所有未完成的调用。
+
+    Returns:
+        list: 与 calls 顺序一致的执行结果列表。
+    """
+    # 这个协程在自己的任务中运行，设置的值只对本任务及其创建的子任务可见
+    if context is not None:
+        for var, value in context.items():
+            var.set(value)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def call(kwargs):
+        async with semaphore:
+            internal.utils.throw_if_interrupted()
+            return await method(**kwargs)
+
+    tasks = [asyncio.ensure_future(call(kwargs)) for kwargs in calls]
+    try:
+        pending = set(tasks)
+        while len(pending) > 0:
+            done, pending = await asyncio.wait(
+                pending, timeout=0.1, return_when=asyncio.FIRST_EXCEPTION
+            )
+            for task in done:
+                if task.exception() is not None:
+                    raise task.exception()
+            # 等待期间 runner 被取消或超过时限时同样停止
+            internal.utils.throw_if_interrupted()
+        return [task.result() for task in tasks]
+    finally:
+        # 一个调用出错、超时、被中断或外层任务被取消时，取消其余仍在运行的调用，
+        # 不再占用并发名额和外部服务的配额
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,8 +1,102 @@
 import math
+import threading
+import time
+import contextvars
 
 
 PROGRESS_BAR_HOOK = None
 
+# 当前正在执行的节点所属 runner 的取消令牌、节点时限和节点信息。
+# 使用 contextvars 而不是线程局部变量，在同一个事件循环上并发执行的异步节点也能各自拿到自己的值
+current_cancellation_token = contextvars.ContextVar("cancellation_token", default=None)
+current_node_deadline = contextvars.ContextVar("node_deadline", default=None)
+current_executing_node = contextvars.ContextVar("executing_node", default=None)
+
+
+class InterruptProcessingException(Exception):
+    """
+    runner 被中断时在节点执行过程中抛出。
+    """
+
+
+class ExecutionTimeoutException(TimeoutError):
+    """
+    节点超过了自己的 TIMEOUT，或者 runner 超过了时间预算时抛出。
+    """
+
+
+class CancellationToken:
+    def __init__(self):
+        self.event = threading.Event()
+        self.deadline = None  # time.monotonic() 时间，超过后 runner 不再继续执行
+
+    def cancel(self):
+        self.event.set()
+
+    def is_cancelled(self):
+        return self.event.is_set()
+
+    def set_time_budget(self, seconds):
+        self.deadline = time.monotonic() + seconds
+
+    def throw_if_cancelled(self):
+        if self.event.is_set():
+            raise InterruptProcessingException()
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            raise ExecutionTimeoutException("runner exceeded its time budget")
+
+
+def set_cancellation_token(token):
+    current_cancellation_token.set(token)
+
+
+def get_cancellation_token():
+    return current_cancellation_token.get()
+
+
+def set_node_deadline(deadline):
+    current_node_deadline.set(deadline)
+
+
+def get_node_deadline():
+    return current_node_deadline.get()
+
+
+def set_executing_node(runner_id, client_id, node_id):
+    # 进度等事件据此归属到正在执行的 runner 和客户端
+    if runner_id is None:
+        current_executing_node.set(None)
+    else:
+        current_executing_node.set((runner_id, client_id, node_id))
+
+
+def get_executing_node():
+    # 返回 (runner_id, client_id, node_id)，不在执行节点时返回 None
+    return current_executing_node.get()
+
+
+def get_remaining_time():
+    # 当前节点距离节点时限和 runner 时间预算中较早者的剩余秒数，都没有设置时返回 None
+    deadlines = [get_node_deadline()]
+    token = get_cancellation_token()
+    if token is not None:
+        deadlines.append(token.deadline)
+    deadlines = [x for x in deadlines if x is not None]
+    if len(deadlines) == 0:
+        return None
+    return min(deadlines) - time.monotonic()
+
+
+def throw_if_interrupted():
+    # 节点可以在耗时的循环中调用，runner 被中断时抛出 InterruptProcessingException，
+    # 超过时限时抛出 ExecutionTimeoutException
+    token = get_cancellation_token()
+    if token is not None:
+        token.throw_if_cancelled()
+    deadline = get_node_deadline()
+    if deadline is not None and time.monotonic() >= deadline:
+        raise ExecutionTimeoutException("node exceeded its timeout")
+
 
 def set_progress_bar_global_hook(function):
     global PROGRESS_BAR_HOOK
@@ -23,6 +117,7 @@ class ProgressBar:
         self.hook = PROGRESS_BAR_HOOK
 
     def update_absolute(self, value, total=None, preview=None):
+        throw_if_interrupted()
         if total is not None:
             self.total = total
         if value > self.total:
@@ -2,28 +2,45 @@ import server
 import asyncio
 import webbrowser
 import execution
+import execution_tools
 import execution_queue
+import execution_cache
 import threading
+import concurrent.futures
 import internal.utils
+import node_schema
 from nodes import init_custom_nodes
 import time
 import gc
+import argparse
+import os
 
 from server import BinaryEventTypes, PyGraphServer
 
 
-def runner_worker(queue: execution_queue.RunnerQueue, server):
-    e = execution.RunnerExecutor(server)
+def runner_worker(
+    queue: execution_queue.RunnerQueue,
+    server,
+    e: execution.RunnerExecutor,
+):
+    # 每个工作线程使用自己的执行器，多个工作线程同时从队列中取出 runner 执行
     while True:
         item, item_id = queue.get()
         execution_start_time = time.perf_counter()
         runner_id = item[1]
-        e.execute(item[2], runner_id, item[3], item[4])
-        queue.task_done(item_id, e.outputs_ui)
-        if server.client_id is not None:
+        e.execute(
+            item[2],
+            runner_id,
+            item[3],
+            item[4],
+            queue.get_cancellation_token(item_id),
+            queue.get_trace(runner_id),
+        )
+        queue.task_done(item_id, e.outputs_ui, e.error_snapshot, e.profile.summary())
+        if e.client_id is not None:
             server.send_sync(
                 "executing", {"node": None,
-                              "runner_id": runner_id}, server.client_id
+                              "runner_id": runner_id}, e.client_id
             )
 
         print(
@@ -47,39 +64,168 @@ async def run(
 
 def hijack_progress(server):
     def hook(value, total, preview: internal.utils.PreviewType):
+        # 进度发送给正在执行这个节点的 runner 的客户端
+        executing = internal.utils.get_executing_node()
+        if executing is None:
+            return
+        runner_id, client_id, node_id = executing
+        if client_id is None:
+            return
         server.send_sync(
-            "progress", {"value": value, "max": total}, server.client_id)
+            "progress",
+            {"value": value, "max": total, "runner_id": runner_id, "node": node_id},
+            client_id,
+        )
         if preview is not None:
             if preview.type == "image":
                 server.send_sync(
                     BinaryEventTypes.UNENCODED_PREVIEW_IMAGE,
                     preview.data,
-                    server.client_id,
+                    client_id,
                 )
 
     internal.utils.set_progress_bar_global_hook(hook)
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--runner-workers",
+        type=int,
+        default=1,
+        help="同时执行 runner 的工作线程数，它们共享输出缓存、进程池和节点实例池；"
+        "工作线程之间只通过输出缓存共享结果，大于 1 时不能与 --cache-entries 0 同时使用",
+    )
+    parser.add_argument(
+        "--parallel-workers",
+        type=int,
+        default=0,
+        help="并行执行互不依赖分支的线程数，0 表示按顺序执行节点",
+    )
+    parser.add_argument(
+        "--process-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="执行 RUN_IN_PROCESS 节点的进程数，0 表示在工作线程中执行这些节点",
+    )
+    parser.add_argument(
+        "--async-concurrency",
+        type=int,
+        default=8,
+        help="async def 节点对列表输入并发调用的上限",
+    )
+    parser.add_argument(
+        "--error-value-max-length",
+        type=int,
+        default=1024,
+        help="execution_error 事件中每个输入输出值的最大长度，完整快照可通过 /history/{runner_id}/error 获取",
+    )
+    parser.add_argument(
+        "--cache-entries",
+        type=int,
+        default=1024,
+        help="跨 runner 共享的输出缓存的最大条目数，0 表示关闭该缓存（此时 --runner-workers 只能为 1）",
+    )
+    parser.add_argument(
+        "--cache-bytes",
+        type=int,
+        default=256 * 1024 * 1024,
+        help="跨 runner 共享的输出缓存的最大字节数",
+    )
+    parser.add_argument(
+        "--disk-cache-dir",
+        type=str,
+        default=None,
+        help="持久化节点输出的磁盘缓存目录，不设置时只使用内存缓存",
+    )
+    parser.add_argument(
+        "--disk-cache-bytes",
+        type=int,
+        default=1024 * 1024 * 1024,
+        help="磁盘缓存的最大字节数",
+    )
+    parser.add_argument(
+        "--max-idle-instances",
+        type=int,
+        default=32,
+        help="节点实例池中保留的空闲实例数上限",
+    )
+    parser.add_argument(
+        "--validation-workers",
+        type=int,
+        default=2,
+        help="在事件循环之外验证提交的节点图的线程数",
+    )
+    parser.add_argument(
+        "--validation-cache-entries",
+        type=int,
+        default=256,
+        help="缓存验证结果的节点图数量，0 表示不缓存",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="用 tracemalloc 记录每个节点的内存峰值，会明显降低执行速度",
+    )
+    args = parser.parse_args()
+    if args.runner_workers > 1 and args.cache_entries <= 0:
+        # 每个工作线程的 outputs 是私有的，没有共享的输出缓存时各工作线程会重复计算相同的上游节点
+        parser.error("--runner-workers greater than 1 requires --cache-entries greater than 0")
+    execution_tools.set_async_node_concurrency(args.async_concurrency)
+    execution_tools.set_error_value_max_length(args.error_value_max_length)
+    execution_tools.set_validation_cache_entries(args.validation_cache_entries)
+
     init_custom_nodes()
+    # 节点类加载完成后一次性编译所有节点的 schema
+    node_schema.build_registry()
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
     server = server.PyGraphServer(loop)
     queue = execution_queue.RunnerQueue(server)
+    if args.cache_entries > 0:
+        disk_cache = None
+        if args.disk_cache_dir is not None:
+            disk_cache = execution_cache.DiskOutputCache(
+                args.disk_cache_dir, args.disk_cache_bytes
+            )
+        server.output_cache = execution_cache.OutputCache(
+            args.cache_entries, args.cache_bytes, disk_cache
+        )
+    elif args.disk_cache_dir is not None:
+        print("Warning: --disk-cache-dir is ignored because --cache-entries is 0")
+    if args.validation_workers > 0:
+        server.validation_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=args.validation_workers, thread_name_prefix="validation_worker"
+        )
     server.add_routes()
     hijack_progress(server)
 
     webbrowser.open("http://127.0.0.1:5000")
 
-    threading.Thread(
-        target=runner_worker,
-        daemon=True,
-        args=(
-            queue,
-            server,
-        ),
-    ).start()
+    # 第一个执行器创建的进程池和节点实例池由所有工作线程共享
+    executors = []
+    for _ in range(max(1, args.runner_workers)):
+        shared = executors[0] if len(executors) > 0 else None
+        executors.append(
+            execution.RunnerExecutor(
+                server,
+                args.parallel_workers,
+                args.process_workers,
+                server.output_cache,
+                args.profile_memory,
+                args.max_idle_instances,
+                shared.process_pool if shared is not None else None,
+                shared.instance_pool if shared is not None else None,
+            )
+        )
+    for i, e in enumerate(executors):
+        threading.Thread(
+            target=runner_worker,
+            name=f"runner_worker_{i}",
+            daemon=True,
+            args=(queue, server, e),
+        ).start()
 
     loop.run_until_complete(run(server, "127.0.0.1", 5000))
     loop.run_forever()
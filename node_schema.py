@@ -0,0 +1,168 @@
+import types
+import sys
+import hashlib
+import inspect
+import nodes
+
+# 字面量输入按声明的类型转换时使用的函数
+INPUT_COERCERS = {"INT": int, "FLOAT": float, "STRING": str}
+
+
+class InputSpec:
+    """
+    节点一个输入的预编译描述，创建后不应再修改。
+
+    Attributes:
+        name (str): 输入名。
+        config (tuple): INPUT_TYPES() 中该输入的原始声明，用于错误信息。
+        type (str | tuple): 输入类型，枚举输入为候选值的元组。
+        options (mappingproxy): 输入的选项，例如 default、min、max、forceInput。
+        coercer (Callable): 字面量输入的类型转换函数，没有时为 None。
+        min (Any): 最小值，没有时为 None。
+        max (Any): 最大值，没有时为 None。
+        choices (frozenset | tuple): 枚举输入的候选值，不是枚举时为 None。
+    """
+
+    __slots__ = ("name", "config", "type", "options", "coercer", "min", "max", "choices")
+
+    def __init__(self, name, config):
+        type_input = config[0]
+        options = config[1] if len(config) > 1 and isinstance(config[1], dict) else {}
+        choices = None
+        if isinstance(type_input, (list, tuple)):
+            type_input = tuple(type_input)
+            try:
+                choices = frozenset(type_input)
+            except TypeError:
+                # 候选值不可哈希时按顺序查找
+                choices = type_input
+        object.__setattr__(self, "name", name)
+        object.__setattr__(self, "config", config)
+        object.__setattr__(self, "type", type_input)
+        object.__setattr__(self, "options", types.MappingProxyType(dict(options)))
+        object.__setattr__(
+            self,
+            "coercer",
+            INPUT_COERCERS.get(type_input, None) if isinstance(type_input, str) else None,
+        )
+        object.__setattr__(self, "min", options.get("min", None))
+        object.__setattr__(self, "max", options.get("max", None))
+        object.__setattr__(self, "choices", choices)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("InputSpec is immutable")
+
+
+class NodeSchema:
+    """
+    节点类的预编译描述，由 INPUT_TYPES() 和类属性计算一次，之后在验证、取输入、缓存键和 /object_info 中复用。
+
+    Attributes:
+        class_def (type): 节点类。
+        input_types (dict): INPUT_TYPES() 的原始返回值，只读，用于 /object_info。
+        required (mappingproxy): 必需输入名 -> InputSpec。
+        optional (mappingproxy): 可选输入名 -> InputSpec。
+        inputs (mappingproxy): 必需和可选输入名 -> InputSpec。
+        hidden (mappingproxy): 隐藏输入名 -> 隐藏输入类型（PROMPT、EXTRA_PNGINFO、UNIQUE_ID）。
+        has_hidden (bool): INPUT_TYPES() 中是否声明了 hidden。
+        return_types (tuple): 输出类型。
+        return_names (tuple): 输出名。
+        output_is_list (tuple): 每个输出是否为列表。
+        code_version (str): 节点代码的标识，见 get_code_version。
+    """
+
+    __slots__ = (
+        "class_def",
+        "input_types",
+        "required",
+        "optional",
+        "inputs",
+        "hidden",
+        "has_hidden",
+        "return_types",
+        "return_names",
+        "output_is_list",
+        "code_version",
+    )
+
+    def __init__(self, class_def):
+        input_types = class_def.INPUT_TYPES()
+        required = {
+            x: InputSpec(x, config) for x, config in input_types.get("required", {}).items()
+        }
+        optional = {
+            x: InputSpec(x, config) for x, config in input_types.get("optional", {}).items()
+        }
+        return_types = tuple(class_def.RETURN_TYPES)
+        values = {
+            "class_def": class_def,
+            "input_types": input_types,
+            "required": types.MappingProxyType(required),
+            "optional": types.MappingProxyType(optional),
+            "inputs": types.MappingProxyType({**required, **optional}),
+            "hidden": types.MappingProxyType(dict(input_types.get("hidden", {}))),
+            "has_hidden": "hidden" in input_types,
+            "return_types": return_types,
+            "return_names": tuple(getattr(class_def, "RETURN_NAMES", return_types)),
+            "output_is_list": tuple(
+                getattr(class_def, "OUTPUT_IS_LIST", [False] * len(return_types))
+            ),
+            "code_version": get_code_version(class_def),
+        }
+        for name, value in values.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("NodeSchema is immutable")
+
+
+def get_code_version(class_def):
+    """
+    计算节点代码的标识，计入缓存键，部署了新的节点代码后旧的（包括磁盘上的）缓存不再命中。
+
+    优先使用类属性 VERSION，否则使用定义节点类的模块源码的哈希，取不到模块源码时使用类的源码，
+    都取不到时只能使用类的完整名称。
+    """
+    version = getattr(class_def, "VERSION", None)
+    if version is not None:
+        return f"version:{version}"
+    try:
+        source = inspect.getsource(sys.modules[class_def.__module__])
+    except (KeyError, OSError, TypeError):
+        try:
+            source = inspect.getsource(class_def)
+        except (OSError, TypeError):
+            return f"name:{class_def.__module__}.{class_def.__qualname__}"
+    return "source:" + hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+# 节点类 -> NodeSchema
+SCHEMAS = {}
+# 每次重建注册表时加一，依赖节点定义的缓存（例如验证结果）以此区分新旧节点类
+REGISTRY_VERSION = 0
+
+
+def build_registry():
+    """
+    为 NODE_CLASS_MAPPINGS 中的每个节点类编译 NodeSchema，加载自定义节点后调用。
+    """
+    global SCHEMAS, REGISTRY_VERSION
+    schemas = {}
+    for class_type, class_def in nodes.NODE_CLASS_MAPPINGS.items():
+        try:
+            schemas[class_def] = NodeSchema(class_def)
+        except Exception as e:
+            print(f"Failed to compile schema of node {class_type}:", e)
+    SCHEMAS = schemas
+    REGISTRY_VERSION += 1
+
+
+def get_schema(class_def):
+    """
+    获取节点类的 NodeSchema，注册表中没有时（例如之后才加入的节点类）编译后加入。
+    """
+    schema = SCHEMAS.get(class_def, None)
+    if schema is None:
+        schema = NodeSchema(class_def)
+        SCHEMAS[class_def] = schema
+    return schema
@@ -8,6 +8,11 @@ import importlib
 import traceback
 import folder_paths
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 
 class BaseNode(ABC):
     # @classmethod：将方法转换为类方法，即该方法可以通过类名直接调用，而不需要先创建类的实例。
@@ -20,7 +25,8 @@ class BaseNode(ABC):
     def INPUT_TYPES(cls):
         pass
 
-    # 这个函数会在执行 execute 之前被调用，用于检查输入是否合法
+    # 这个函数会在执行 execute 之前被调用，用于检查输入是否合法。每个节点只调用一次，
+    # 参数是类型转换后的字面量输入，返回 True 表示合法，返回 False 或错误信息表示不合法
     # def VALIDATE_INPUTS(*args, **kwargs):
 
     FUNCTION: str = "execute"
@@ -28,9 +34,35 @@ class BaseNode(ABC):
     OUTPUT_NODE: bool = False
     DESCRIPTION: str
     INPUT_IS_LIST: bool = False
+    # CPU 密集的节点可以设为 True，在执行器的进程池中运行，输入输出需要能被 pickle
+    RUN_IN_PROCESS: bool = False
+    # 设为 True 时 FUNCTION 只调用一次，每个输入都是对齐后的整列（INT/FLOAT 为 numpy 数组），返回整列输出。
+    # 没有安装 numpy 时会退回到逐个元素调用，因此函数需要同时支持整列和单个值。
+    INPUT_IS_BATCH: bool = False
+    # FUNCTION 可以返回生成器，逐个产生结果。设为 True 的节点和 INPUT_IS_LIST 一样只调用一次，
+    # 来自流式输出的输入是迭代器，可以在上游产生元素时就开始处理
+    INPUT_IS_STREAM: bool = False
+    # 节点的默认执行时限（秒），超过后节点以超时错误结束，队列继续执行后续 runner。None 表示不限制
+    TIMEOUT: float | None = None
+    # 节点有外部副作用（例如发送邮件）时设为 True，这样的节点不会被合并执行，输出也不会被缓存复用
+    SIDE_EFFECTS: bool = False
+    # 输出只取决于输入、没有副作用的节点设为 True，所有输入都是常量时会在提交时直接求值（常量折叠）
+    PURE: bool = False
+    # 节点代码的版本，计入持久化的输出缓存键，修改 FUNCTION 的行为后应更新。
+    # None 时使用定义节点类的模块源码的哈希，模块中任何改动都会使旧的缓存失效
+    VERSION: str | None = None
     RETURN_TYPES: tuple[str, ...]
     RETURN_NAMES: tuple[str, ...]
     # OUTPUT_IS_LIST: tuple[bool, ...] = [False] * len(RETURN_TYPES)
+
+    # 节点实例由执行器的实例池按类型复用。新建实例后调用 setup()，实例被淘汰时调用 teardown()，
+    # 可以在这里创建和释放客户端、模型、SMTP 会话等昂贵的资源
+    def setup(self):
+        pass
+
+    def teardown(self):
+        pass
+
     # def execute(self, *args, **kwargs):
     #     pass
 
@@ -58,6 +90,8 @@ class AddNode(BaseNode):
             }
         }
 
+    INPUT_IS_BATCH = True
+    PURE = True
     RETURN_TYPES = ("FLOAT",)
     FUNCTION = "execute"
     DESCRIPTION = "Adds two numbers together"
@@ -87,6 +121,8 @@ class SubtractNode(BaseNode):
             }
         }
 
+    INPUT_IS_BATCH = True
+    PURE = True
     RETURN_TYPES = ("FLOAT",)
     FUNCTION = "subtract"
     DESCRIPTION = "Subtracts two numbers"
@@ -116,6 +152,8 @@ class MultiplyNode(BaseNode):
             }
         }
 
+    INPUT_IS_BATCH = True
+    PURE = True
     RETURN_TYPES = ("FLOAT",)
     FUNCTION = "execute"
     DESCRIPTION = "Multiplies two numbers"
@@ -145,12 +183,18 @@ class DivideNode(BaseNode):
             }
         }
 
+    INPUT_IS_BATCH = True
+    PURE = True
     RETURN_TYPES = ("FLOAT",)
     FUNCTION = "execute"
     DESCRIPTION = "Divides two numbers"
     CATEGORY = "base/Math"
 
     def execute(self, dividend, divisor):
+        if numpy is not None and isinstance(divisor, numpy.ndarray):
+            nonzero = divisor != 0
+            quotient = dividend / numpy.where(nonzero, divisor, 1)
+            return (numpy.where(nonzero, quotient, float("inf")),)
         if divisor != 0:
             return (dividend / divisor,)
         else:
@@ -162,6 +206,7 @@ class TextInputNode(BaseNode):
     def INPUT_TYPES(cls):
         return {"required": {"text": ("STRING", {"multiline": True})}}
 
+    PURE = True
     RETURN_TYPES = ("STRING",)
     RETURN_NAMES = ("text",)
     FUNCTION = "execute"
@@ -191,6 +236,7 @@ class StringFunction:
     FUNCTION = "exec"
     CATEGORY = "base"
     OUTPUT_NODE = True
+    PURE = True
 
     def exec(self, action, tidy_tags, text_a, text_b, text_c=""):
         # Converted inputs are sent as the string of 'undefined' if not connected
@@ -250,6 +296,7 @@ class ShowText:
         }
 
     INPUT_IS_LIST = True
+    INPUT_IS_STREAM = True
     RETURN_TYPES = ("STRING",)
     FUNCTION = "notify"
     OUTPUT_NODE = True
@@ -258,6 +305,19 @@ class ShowText:
     CATEGORY = "base"
 
     def notify(self, text, unique_id=None, extra_pnginfo=None):
+        # 上游是流式输出时，每收到一段文本就更新一次显示
+        if not isinstance(text, list):
+            return self.notify_stream(text, unique_id, extra_pnginfo)
+        return self.show(text, unique_id, extra_pnginfo)
+
+    def notify_stream(self, text, unique_id=None, extra_pnginfo=None):
+        received = []
+        for t in text:
+            received.append(t)
+            yield {"ui": {"text": [t]}, "result": ([t],)}
+        self.show(received, unique_id, extra_pnginfo)
+
+    def show(self, text, unique_id=None, extra_pnginfo=None):
         if unique_id and extra_pnginfo and "workflow" in extra_pnginfo[0]:
             workflow = extra_pnginfo[0]["workflow"]
             node = next((x for x in workflow["nodes"] if str(
@@ -5,15 +5,19 @@ from PIL import Image, ImageOps
 import aiohttp
 import sys
 import asyncio
+import concurrent.futures
 import uuid
+import time
 import mimetypes  # 映射文件名到 MIME 类型
 import nodes
+import node_schema
 import glob
 import os
 import struct
 import execution
 import execution_tools
 import execution_queue
+import execution_cache
 
 
 class BinaryEventTypes:
@@ -68,6 +72,9 @@ class PyGraphServer:
 
         self.number = 0
         self.runner_queue: execution_queue.RunnerQueue = None
+        self.output_cache: execution_cache.OutputCache = None
+        # 验证节点图的线程池，为 None 时使用事件循环的默认线程池
+        self.validation_pool: concurrent.futures.ThreadPoolExecutor = None
         self.loop = loop
         # Queue 是 asyncio 模块中的一个类，用于实现异步队列。
         # 异步队列是一种特殊的队列，它可以在异步程序中安全地传递和共享数据。
@@ -82,8 +89,8 @@ class PyGraphServer:
         self.routes = routes
         # 保存客户端连接
         self.sockets: Dict[str, web.WebSocketResponse] = dict()
-        self.client_id = None
-        self.last_node_id = None
+        # runner ID -> (客户端 ID, 正在执行的节点 ID)，多个工作线程同时执行时各自记录
+        self.executing = {}
 
         @routes.get("/ws")
         async def websocket_handler(request: web.Request):
@@ -103,9 +110,12 @@ class PyGraphServer:
                 await self.send(
                     "status", {"status": self.get_queue_info(), "sid": sid}, sid
                 )
-                # On reconnect if we are the currently executing client send the current node
-                if self.client_id == sid and self.last_node_id is not None:
-                    await self.send("executing", {"node": self.last_node_id}, sid)
+                # On reconnect send the current node of every runner this client is executing
+                for runner_id, (client_id, node_id) in list(self.executing.items()):
+                    if client_id == sid:
+                        await self.send(
+                            "executing", {"node": node_id, "runner_id": runner_id}, sid
+                        )
 
                 async for msg in ws:
                     if msg.type == aiohttp.WSMsgType.ERROR:
@@ -130,6 +140,8 @@ class PyGraphServer:
                     == "python_embeded",
                 }
             }
+            if self.output_cache is not None:
+                system_stats["output_cache"] = self.output_cache.stats()
             return web.json_response(system_stats)
 
         @routes.get("/extensions")
@@ -183,6 +195,22 @@ class PyGraphServer:
             runner_id = request.match_info.get("runner_id", None)
             return web.json_response(self.runner_queue.get_history(runner_id=runner_id))
 
+        @routes.get("/history/{runner_id}/error")
+        async def get_history_error(request: web.Request):
+            runner_id = request.match_info.get("runner_id", None)
+            snapshot = self.runner_queue.get_error_snapshot(runner_id)
+            if snapshot is None:
+                return web.json_response({}, status=404)
+            return web.json_response(snapshot)
+
+        @routes.get("/history/{runner_id}/trace")
+        async def get_history_trace(request: web.Request):
+            runner_id = request.match_info.get("runner_id", None)
+            trace = self.runner_queue.get_trace(runner_id)
+            if trace is None:
+                return web.json_response({}, status=404)
+            return web.json_response(trace.to_json())
+
         @routes.post("/history")
         async def post_history(request: web.Request):
             json_data = await request.json()
@@ -196,6 +224,80 @@ class PyGraphServer:
 
             return web.Response(status=200)
 
+        @routes.post("/interrupt")
+        async def post_interrupt(request: web.Request):
+            # 按 runner_id 中断一个 runner，没有指定 runner_id 时只中断 client_id 提交的 runner，
+            # 不会影响其他客户端的执行
+            json_data = None
+            if request.can_read_body:
+                try:
+                    json_data = await request.json()
+                except ValueError:
+                    json_data = None
+            if not isinstance(json_data, dict):
+                return web.json_response(
+                    {"error": "runner_id or client_id required"}, status=400
+                )
+            runner_id = json_data.get("runner_id", None)
+            client_id = json_data.get("client_id", None)
+            if runner_id is None and client_id is None:
+                return web.json_response(
+                    {"error": "runner_id or client_id required"}, status=400
+                )
+            interrupted = self.runner_queue.interrupt(runner_id, client_id)
+            return web.json_response({"interrupted": interrupted})
+
+        @routes.post("/validate")
+        async def post_validate(request: web.Request):
+            # 只验证不执行，不进入 RunnerQueue。runners 可以是节点图的列表，或名称 -> 节点图的字典
+            json_data = await request.json()
+            runners = None
+            if isinstance(json_data, dict):
+                runners = json_data.get("runners", None)
+            if isinstance(runners, list):
+                runners = {str(i): runner for i, runner in enumerate(runners)}
+            if not isinstance(runners, dict) or len(runners) == 0:
+                return web.json_response(
+                    {"error": "no runners", "results": {}}, status=400
+                )
+
+            def validate(runner):
+                try:
+                    valid = execution_tools.validate_runner(runner)
+                except Exception as ex:
+                    # 节点图本身格式错误（例如未知的节点类型）时只影响这一个节点图
+                    error = {
+                        "type": "invalid_runner",
+                        "message": "Exception when validating runner",
+                        "details": str(ex),
+                        "extra_info": {
+                            "exception_type": execution_tools.full_type_name(type(ex)),
+                        },
+                    }
+                    return {"valid": False, "error": error, "outputs": [], "node_errors": {}}
+                return {
+                    "valid": valid[0],
+                    "error": valid[1],
+                    "outputs": valid[2],
+                    "node_errors": valid[3],
+                }
+
+            # 所有节点图在验证线程池中并发验证，共享节点 schema 和验证结果缓存
+            names = list(runners.keys())
+            results = await asyncio.gather(
+                *[
+                    self.loop.run_in_executor(self.validation_pool, validate, runners[x])
+                    for x in names
+                ]
+            )
+            results = dict(zip(names, results))
+            return web.json_response(
+                {
+                    "valid": all(r["valid"] for r in results.values()),
+                    "results": results,
+                }
+            )
+
         @routes.post("/execute")
         async def execute(request: web.Request):
             json_data = await request.json()
@@ -211,7 +313,10 @@ class PyGraphServer:
                 self.number += 1
             if "runner" in json_data:
                 runner = json_data["runner"]
-                valid = execution_tools.validate_runner(runner)
+                # 验证可能很耗时，放到线程池中执行，避免阻塞事件循环中的其他请求和 websocket
+                valid = await self.loop.run_in_executor(
+                    self.validation_pool, execution_tools.validate_runner, runner
+                )
                 extra_data = {}
                 if "extra_data" in json_data:
                     extra_data = json_data["extra_data"]
@@ -242,19 +347,12 @@ class PyGraphServer:
 
         def node_info(node_class):
             obj_class = nodes.NODE_CLASS_MAPPINGS[node_class]
+            schema = node_schema.get_schema(obj_class)
             info = {}
-            info["input"] = obj_class.INPUT_TYPES()
-            info["output"] = obj_class.RETURN_TYPES
-            info["output_is_list"] = (
-                obj_class.OUTPUT_IS_LIST
-                if hasattr(obj_class, "OUTPUT_IS_LIST")
-                else [False] * len(obj_class.RETURN_TYPES)
-            )
-            info["output_name"] = (
-                obj_class.RETURN_NAMES
-                if hasattr(obj_class, "RETURN_NAMES")
-                else info["output"]
-            )
+            info["input"] = schema.input_types
+            info["output"] = list(schema.return_types)
+            info["output_is_list"] = list(schema.output_is_list)
+            info["output_name"] = list(schema.return_names)
             info["name"] = node_class
             info["display_name"] = (
                 nodes.NODE_DISPLAY_NAME_MAPPINGS[node_class]
@@ -372,15 +470,31 @@ class PyGraphServer:
     def queue_updated(self):
         self.send_sync("status", {"status": self.get_queue_info()})
 
+    # 记录 runner 正在执行的节点，node_id 为 None 表示 runner 执行结束
+    def set_executing_node(self, runner_id, client_id, node_id):
+        if node_id is None:
+            self.executing.pop(runner_id, None)
+        else:
+            self.executing[runner_id] = (client_id, node_id)
+
     # 用于发送同步消息的函数
     def send_sync(self, event, data, sid=None):
-        self.loop.call_soon_threadsafe(self.messages.put_nowait, (event, data, sid))
+        self.loop.call_soon_threadsafe(
+            self.messages.put_nowait, (event, data, sid, time.perf_counter())
+        )
 
     # 从队列里面取得消息并发送
     async def publish_loop(self):
         while True:
-            msg = await self.messages.get()
-            await self.send(*msg)
+            event, data, sid, send_time = await self.messages.get()
+            await self.send(event, data, sid)
+            # 记录了时间线的 runner 同时记录从 send_sync 到实际发送的延迟
+            if isinstance(data, dict) and "runner_id" in data:
+                trace = self.runner_queue.get_trace(data["runner_id"])
+                if trace is not None:
+                    trace.complete(
+                        f"publish {event}", "websocket", send_time, time.perf_counter()
+                    )
 
     async def start(self, address, port, verbose=True, call_on_start=None):
         runner = web.AppRunner(self.app)